@@ -0,0 +1,1025 @@
+import argparse
+import asyncio
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from datetime import date, datetime, timedelta
+
+from main import (BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, BILL_FORMATS, CATALOG_SELECT, MED_COLUMNS, MED_SELECT,
+                  PAGES, PASSWORD_ITERATIONS, PROFILER, STOCK_TOTALS_SELECT, AdminDB, Bill, CatalogColumns, MedicineDB,
+                  Profiler, Session, StockShortage, TreeviewSync, epoch_day, exp_day_of, format_bill, check_integrity,
+                  hash_password, rerender_bills, snapshot_database, verify_password, write_bill_files)
+from service import serve
+
+# ---------------------------
+# Synthetic Data
+# ---------------------------
+PURPOSES = ["Fever", "Cold", "Cough", "Headache", "Allergy", "Acidity", "Diabetes",
+            "Hypertension", "Pain Relief", "Infection", "Vitamin", "Skin Care"]
+PURPOSE_WEIGHTS = [14, 10, 9, 8, 7, 6, 8, 7, 12, 9, 6, 4]  # share of a typical store's range
+TYPES = ["Tablet", "Capsule", "Syrup", "Injection", "Ointment", "Drops"]
+STEMS = ["Para", "Amoxi", "Ceti", "Ibu", "Metfor", "Losar", "Omepra", "Azithro", "Levo", "Diclo",
+         "Panto", "Atorva", "Amlo", "Clopi", "Monte", "Rani", "Dexa", "Predni", "Fluco", "Cefi"]
+SUFFIXES = ["cetamol", "cillin", "rizine", "profen", "min", "tan", "zole", "mycin", "floxacin", "fenac",
+            "prazole", "statin", "dipine", "grel", "lukast", "tidine", "methasone", "solone", "nazole", "xime"]
+MAKERS = ["Cipla", "Sun Pharma", "Pfizer", "Unilab", "Abbott", "GSK", "Zydus", "Lupin"]
+
+
+def create_medicine_db(path, n_skus, seed=0, expiry_days=(-60, 1095)):
+    # A legacy all-text med table (as shipped before the migrations), so opening it
+    # also exercises the schema upgrade. Expiries fall uniformly in expiry_days
+    # (relative to today); the default leaves about 5% of the range expired.
+    rnd = random.Random(seed)
+    today = date.today()
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS med (sl_no INTEGER, name TEXT, type TEXT, qty_left TEXT, "
+                 "cost TEXT, purpose TEXT, exp_date TEXT, rack TEXT, mfg TEXT)")
+    for chunk_start in range(1, n_skus + 1, 50000):
+        rows = []
+        for sl_no in range(chunk_start, min(chunk_start + 50000, n_skus + 1)):
+            exp = (today + timedelta(days=rnd.randint(*expiry_days))).strftime("%d/%m/%y")
+            name = f"{rnd.choice(STEMS)}{rnd.choice(SUFFIXES)} {rnd.choice((5, 10, 20, 50, 100, 250, 500))}mg"
+            rows.append((sl_no, name, rnd.choice(TYPES), str(rnd.randint(50, 5000)),
+                         f"{rnd.uniform(1, 500):.2f}", rnd.choices(PURPOSES, PURPOSE_WEIGHTS)[0], exp,
+                         f"R{rnd.randint(1, 40)}", rnd.choice(MAKERS)))
+        conn.executemany("INSERT INTO med VALUES (?,?,?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def create_admin_db(path, n_users):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS log (username TEXT, password TEXT NOT NULL, PRIMARY KEY(username))")
+    conn.executemany("INSERT INTO log VALUES (?,?)",
+                     [("admin", "admin")] + [(f"user{i}", f"vc{i}") for i in range(1, n_users)])
+    conn.commit()
+    conn.close()
+
+
+def generate(out_dir, n_skus, n_users, expiry_days):
+    # Writes medicine.db/admin.db for --data, already migrated so timing runs start warm.
+    os.makedirs(out_dir, exist_ok=True)
+    db_path = os.path.join(out_dir, "medicine.db")
+    admin_path = os.path.join(out_dir, "admin.db")
+    for path in (db_path, admin_path):
+        if os.path.exists(path):
+            sys.exit(f"{path} already exists")
+    start = time.perf_counter()
+    create_medicine_db(db_path, n_skus, expiry_days=expiry_days)
+    create_admin_db(admin_path, n_users)
+    generated = time.perf_counter() - start
+    MedicineDB(db_path).conn.close()
+    AdminDB(admin_path).conn.close()
+    print(f"generate: {n_skus} SKUs, {n_users} users in {out_dir}")
+    print(f"  rows written in {generated:.1f} s, migrated in {time.perf_counter() - start - generated:.1f} s, "
+          f"medicine.db {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+
+def expiry_span(text):
+    low, _, high = text.partition(":")
+    return int(low), int(high)
+
+
+class CommitCounter:
+    def __init__(self, conn):
+        self.commits = 0
+        conn.set_trace_callback(self)
+
+    def __call__(self, statement):
+        if statement.startswith("COMMIT"):
+            self.commits += 1
+
+
+# ---------------------------
+# Checkout
+# ---------------------------
+def sellable_skus(db):
+    # Expired stock cannot be checked out; the synthetic data has expiries in the past.
+    today = (date.today() - date(1970, 1, 1)).days
+    return [row[0] for row in db.conn.execute("SELECT sl_no FROM med WHERE exp_day >= ?", (today,))]
+
+
+def per_line_checkout(db, bill_items):
+    # The pre-batching BillingPage behaviour: one lookup and one commit per line.
+    for sl_no, _, qty, _ in bill_items:
+        med = db.get_medicine_by_sl(sl_no)
+        if med:
+            db.update_quantity(sl_no, max(0, int(med[3]) - qty))
+
+
+def bench_checkout(db_path, n_skus, bill_sizes, repeats):
+    db = MedicineDB(db_path)
+    counter = CommitCounter(db.conn)
+    rnd = random.Random(1)
+    skus = sellable_skus(db)
+    print(f"checkout: {n_skus} SKUs, {repeats} bills per size")
+    print(f"{'lines':>6} {'method':>10} {'commits/bill':>13} {'mean ms':>9} {'p95 ms':>9}")
+    for size in bill_sizes:
+        for label, run in (("per-line", per_line_checkout), ("checkout", MedicineDB.checkout)):
+            timings = []
+            counter.commits = 0
+            for _ in range(repeats):
+                bill = [(str(sl), f"Medicine {sl}", 1, 1.0) for sl in rnd.sample(skus, size)]
+                start = time.perf_counter()
+                try:
+                    run(db, bill)
+                except StockShortage:
+                    pass
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(f"{size:>6} {label:>10} {counter.commits / repeats:>13.1f} "
+                  f"{statistics.mean(timings):>9.2f} {p95:>9.2f}")
+    db.conn.close()
+
+
+def bench_lots(db_path, n_skus, lots_per_sku, repeats):
+    # FEFO allocation cost: every SKU gets extra lots with scattered expiries, then
+    # 50-line bills are checked out across them.
+    db = MedicineDB(db_path)
+    rnd = random.Random(4)
+    today = date.today()
+    start = time.perf_counter()
+    for sl_no in range(1, n_skus + 1):
+        for lot in range(lots_per_sku - 1):
+            exp = today + timedelta(days=rnd.randint(-30, 720))
+            db.receive_lot(sl_no, f"L{lot}", rnd.randint(5, 50), exp.strftime("%d/%m/%y"))
+    print(f"lots: {n_skus} SKUs x {lots_per_sku} lots, received in {time.perf_counter() - start:.1f} s")
+    skus = sellable_skus(db)
+    samples = []
+    for _ in range(repeats):
+        items = [(sl_no, "item", rnd.randint(1, 30), 1.0) for sl_no in rnd.sample(skus, 50)]
+        start = time.perf_counter()
+        try:
+            db.checkout(items)
+        except StockShortage:
+            continue
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"  50-line FEFO checkout: p50 {samples[len(samples) // 2]:.2f} ms, max {samples[-1]:.2f} ms "
+          f"({len(samples)} bills)")
+    db.conn.close()
+
+
+# ---------------------------
+# Bill Output
+# ---------------------------
+def bench_bills(db_path, n_bills, repeats):
+    # Rendering cost per format, what the cashier waits for at checkout with the file
+    # written inline versus handed to the spooler, and a bulk audit re-render.
+    db = MedicineDB(db_path)
+    rnd = random.Random(8)
+    skus = sellable_skus(db)
+    out_dir = tempfile.mkdtemp(dir=os.path.dirname(db_path))
+    for _ in range(n_bills):
+        db.checkout([(sl_no, "item", 1, 1.0) for sl_no in rnd.sample(skus, 10)], "Customer", "Address")
+    sale, items = db.get_sale(n_bills)
+    print(f"bills: {n_bills} bills of 10 lines")
+    for fmt, (_, render) in BILL_FORMATS.items():
+        ms = timed_ms(lambda: render(sale, items), repeats)
+        print(f"  render {fmt:<8} {ms * 1000:7.0f} us/bill")
+
+    def sale_and_file(spool):
+        bill_no = db.checkout([(sl_no, "item", 1, 1.0) for sl_no in rnd.sample(skus, 10)])
+        if spool:
+            spooled.append(bill_no)
+        else:
+            write_bill_files(db, bill_no, ("pdf",), out_dir)
+    spooled = []
+    print(f"  checkout + pdf inline   {timed_ms(lambda: sale_and_file(False), repeats):7.2f} ms")
+    print(f"  checkout + spooled      {timed_ms(lambda: sale_and_file(True), repeats):7.2f} ms")
+
+    # Fetching is a small share of a re-render; batching matters most for a remote
+    # terminal, where get_sale per bill is one HTTP round trip each.
+    today = date.today()
+    start = time.perf_counter()
+    for bill_no in range(1, n_bills + 1):
+        db.get_sale(bill_no)
+    per_bill = time.perf_counter() - start
+    start = time.perf_counter()
+    db.bills_between(today, today)
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    count = rerender_bills(db, today, today, ["pdf"], out_dir)
+    total = time.perf_counter() - start
+    print(f"  fetch, get_sale per bill       {per_bill * 1000:7.1f} ms")
+    print(f"  fetch, bills_between           {batched * 1000:7.1f} ms")
+    print(f"  re-render to pdf               {count / total:7.0f} bills/s")
+    shutil.rmtree(out_dir)
+    db.conn.close()
+
+
+# ---------------------------
+# Columnar Catalog
+# ---------------------------
+def retained_bytes(build):
+    # Memory still held by build()'s result once temporaries are gone.
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_columns(db_path, n_skus, repeats):
+    # The same analytics over the tuple rows fetch_all_medicines returns and over a
+    # CatalogColumns snapshot.
+    db = MedicineDB(db_path)
+
+    def fetch_rows():
+        db.cursor.execute(MED_SELECT)
+        return db.cursor.fetchall()
+
+    def build_columns():
+        return CatalogColumns(fetch_rows())
+
+    rows, row_bytes = retained_bytes(fetch_rows)
+    columns, column_bytes = retained_bytes(build_columns)
+    build_ms = timed_ms(build_columns, min(repeats, 5))
+    today = epoch_day(date.today())
+    purpose = PURPOSES[0]
+    cases = [
+        ("stock value",
+         lambda: sum(int(r[3]) * float(r[4]) for r in rows),
+         lambda: columns.stock_value()),
+        ("expiring in 30 days",
+         lambda: sum(1 for r in rows if today <= (exp_day_of(r[6]) or -1) <= today + 30),
+         lambda: columns.count(columns.between("exp_day", today, today + 30))),
+        (f"value of '{purpose}' stock",
+         lambda: sum(int(r[3]) * float(r[4]) for r in rows if r[5] == purpose),
+         lambda: columns.stock_value(columns.equals("purpose", purpose))),
+        ("value by purpose",
+         lambda: group_value(rows),
+         lambda: columns.stock_value_by("purpose")),
+    ]
+    print(f"columns: {n_skus} SKUs, {repeats} runs")
+    print(f"  memory  tuple rows {row_bytes / 2**20:7.1f} MiB   columns {column_bytes / 2**20:7.1f} MiB "
+          f"({columns.nbytes() / 2**20:.1f} MiB of arrays), snapshot built in {build_ms:.0f} ms")
+    print(f"  {'aggregate':<28} {'tuples ms':>10} {'columns ms':>11}")
+    for label, over_rows, over_columns in cases:
+        print(f"  {label:<28} {timed_ms(over_rows, repeats):>10.2f} {timed_ms(over_columns, repeats):>11.2f}")
+    db.conn.close()
+
+
+def group_value(rows):
+    totals = {}
+    for r in rows:
+        totals[r[5]] = totals.get(r[5], 0.0) + int(r[3]) * float(r[4])
+    return totals
+
+
+# ---------------------------
+# Backup & Restore
+# ---------------------------
+def bench_backup(db_path, n_skus, n_bills):
+    # Snapshot throughput by step size, then checkout latency with and without a
+    # backup running alongside (the default step size and pause), then check + restore.
+    db = MedicineDB(db_path)
+    rnd = random.Random(4)
+    skus = sellable_skus(db)
+    dest = os.path.join(os.path.dirname(db_path), "snapshot.db")
+    size = os.path.getsize(db_path) / 2**20
+    print(f"backup: {n_skus} SKUs, {size:.1f} MiB")
+    for pages in (64, 256, 1024, -1):
+        start = time.perf_counter()
+        snapshot_database(db_path, dest, pages=pages, sleep=0)
+        elapsed = time.perf_counter() - start
+        print(f"  {pages if pages > 0 else 'all':>5} pages/step  {elapsed * 1000:7.0f} ms  {size / elapsed:7.1f} MiB/s")
+
+    def checkout_latencies():
+        samples = []
+        for _ in range(n_bills):
+            start = time.perf_counter()
+            db.checkout([(sl_no, "item", 1, 1.0) for sl_no in rnd.sample(skus, 10)])
+            samples.append((time.perf_counter() - start) * 1000)
+        return sorted(samples)
+
+    idle = checkout_latencies()
+    stop = threading.Event()
+    backups = []
+
+    def keep_backing_up():
+        while not stop.is_set():
+            start = time.perf_counter()
+            snapshot_database(db_path, dest, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP)
+            backups.append(time.perf_counter() - start)
+
+    thread = threading.Thread(target=keep_backing_up)
+    thread.start()
+    busy = checkout_latencies()
+    stop.set()
+    thread.join()
+    print(f"  checkout_10 while idle       p50 {percentile(idle, 0.5):6.2f} ms  p99 {percentile(idle, 0.99):6.2f} ms")
+    print(f"  checkout_10 during backups   p50 {percentile(busy, 0.5):6.2f} ms  p99 {percentile(busy, 0.99):6.2f} ms"
+          f"  ({len(backups)} backups of {BACKUP_PAGES_PER_STEP} pages/step, "
+          f"{statistics.median(backups) * 1000:.0f} ms each)")
+    start = time.perf_counter()
+    problems = check_integrity(dest)
+    print(f"  integrity check {(time.perf_counter() - start) * 1000:7.0f} ms  {'ok' if not problems else problems[0]}")
+    start = time.perf_counter()
+    db.restore(dest)
+    print(f"  restore         {(time.perf_counter() - start) * 1000:7.0f} ms")
+    db.conn.close()
+
+
+# ---------------------------
+# Stock Refresh
+# ---------------------------
+class CountingTreeview:
+    # Stands in for ttk.Treeview so refresh logic can be timed without a display.
+    def __init__(self):
+        self.items = {}
+        self.operations = 0
+        self._next = 0
+
+    def get_children(self):
+        return list(self.items)
+
+    def insert(self, parent, index, iid=None, values=()):
+        if iid is None:
+            self._next += 1
+            iid = f"I{self._next}"
+        self.items[iid] = values
+        self.operations += 1
+        return iid
+
+    def item(self, iid, values=()):
+        self.items[iid] = values
+        self.operations += 1
+
+    def delete(self, *iids):
+        for iid in iids:
+            del self.items[iid]
+        self.operations += len(iids)
+
+
+def full_rebuild(tree, db):
+    # The pre-diffing refresh_stock: clear everything and insert the whole table.
+    for item in tree.get_children():
+        tree.delete(item)
+    for med in db.fetch_all_medicines():
+        tree.insert("", "end", values=med)
+
+
+def bench_refresh(db_path, n_skus, repeats):
+    db = MedicineDB(db_path)
+    rnd = random.Random(2)
+    skus = sellable_skus(db)
+    print(f"refresh: {n_skus} SKUs, one sale of 10 lines between refreshes")
+    print(f"{'method':>12} {'widget ops':>11} {'mean ms':>9}")
+    for label, page_size in (("full", None), ("incremental", n_skus + 1), ("paged", 500)):
+        tree = CountingTreeview()
+        view = TreeviewSync(tree, tuple, page_size=page_size or n_skus + 1)
+        refresh = (lambda: full_rebuild(tree, db)) if page_size is None else (lambda: view.sync(db.catalog))
+        refresh()
+        timings = []
+        tree.operations = 0
+        for _ in range(repeats):
+            db.checkout([(sl, "", 1, 1.0) for sl in rnd.sample(skus, 10)])
+            start = time.perf_counter()
+            refresh()
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{label:>12} {tree.operations / repeats:>11.0f} {statistics.mean(timings):>9.2f}")
+    db.conn.close()
+
+
+# ---------------------------
+# Startup
+# ---------------------------
+def bench_startup(db_path, n_skus, repeats):
+    # Login -> main screen, headless. Eager is what building every page at login
+    # used to cost (both stock trees filled, both comboboxes loaded); lazy shows
+    # the dashboard and prefetches the rest in the background.
+    def open_dashboard():
+        db = MedicineDB(db_path)
+        db.dashboard_stats()
+        db.reorder_suggestions()
+        return db
+
+    def fill_stock_tree(db):
+        TreeviewSync(CountingTreeview(), tuple).sync(db.catalog)
+
+    timings = {"eager": [], "lazy": [], "prefetch": [], "first stock page": []}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        db = open_dashboard()
+        fill_stock_tree(db)
+        fill_stock_tree(db)
+        db.get_medicine_names()
+        db.get_purposes()
+        timings["eager"].append((time.perf_counter() - start) * 1000)
+        db.conn.close()
+
+        start = time.perf_counter()
+        db = open_dashboard()
+        timings["lazy"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        db.load_catalog()
+        db.get_medicine_names()
+        db.get_purposes()
+        timings["prefetch"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        fill_stock_tree(db)
+        timings["first stock page"].append((time.perf_counter() - start) * 1000)
+        db.conn.close()
+    print(f"startup: {n_skus} SKUs, {repeats} runs (widget work counted, not drawn)")
+    for label, samples in timings.items():
+        print(f"  {label:<18} median {statistics.median(samples):8.1f} ms, max {max(samples):8.1f} ms")
+
+
+# ---------------------------
+# Expiry Report
+# ---------------------------
+def scan_expiring(db, days):
+    # One strptime per row over a full scan, as ExpiryCheckPage used to do per product.
+    today = date.today()
+    horizon = today + timedelta(days=days)
+    db.cursor.execute(MED_SELECT)
+    hits = []
+    for med in db.cursor.fetchall():
+        exp = datetime.strptime(med[6], "%d/%m/%y").date()
+        if today <= exp <= horizon:
+            hits.append(med)
+    return sorted(hits, key=lambda med: datetime.strptime(med[6], "%d/%m/%y"))
+
+
+def bench_expiry(db_path, n_skus, repeats):
+    db = MedicineDB(db_path)
+    print(f"expiry: {n_skus} SKUs, batches expiring within N days")
+    print(f"{'days':>6} {'rows':>7} {'scan ms':>9} {'index ms':>9}")
+    for days in (7, 30, 90):
+        results = {}
+        for label, run in (("scan", scan_expiring), ("index", MedicineDB.expiring_within)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                rows = run(db, days)
+            results[label] = ((time.perf_counter() - start) * 1000 / repeats, len(rows))
+        print(f"{days:>6} {results['index'][1]:>7} {results['scan'][0]:>9.2f} {results['index'][0]:>9.2f}")
+    db.conn.close()
+
+
+# ---------------------------
+# Search
+# ---------------------------
+def like_search(db, text, limit=50):
+    pattern = f"%{text}%"
+    db.cursor.execute(MED_SELECT + " WHERE name LIKE ? OR purpose LIKE ? OR mfg LIKE ? LIMIT ?",
+                      (pattern, pattern, pattern, limit))
+    return db.cursor.fetchall()
+
+
+def bench_search(db_path, n_skus, repeats):
+    db = MedicineDB(db_path)
+    print(f"search: {n_skus} SKUs, one query per keystroke (fts index: {db.has_search_index})")
+    print(f"{'query':>14} {'hits':>5} {'like ms':>9} {'search ms':>10}")
+    for word in ("paracetamol", "azitromycin"):
+        for end in range(1, len(word) + 1):
+            text = word[:end]
+            timings = {}
+            for label, run in (("like", like_search), ("search", MedicineDB.search)):
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    hits = run(db, text)
+                timings[label] = (time.perf_counter() - start) * 1000 / repeats
+            print(f"{text:>14} {len(hits):>5} {timings['like']:>9.2f} {timings['search']:>10.2f}")
+    db.conn.close()
+
+
+# ---------------------------
+# Bulk Import / Export
+# ---------------------------
+def write_supplier_csv(path, n_rows, seed=3):
+    rnd = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        f.write(",".join(MED_COLUMNS) + "\n")
+        for _ in range(n_rows):
+            exp = f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(24, 30):02d}"
+            f.write(f",{rnd.choice(STEMS)}{rnd.choice(SUFFIXES)},{rnd.choice(TYPES)},{rnd.randint(1, 999)},"
+                    f"{rnd.uniform(1, 500):.2f},{rnd.choice(PURPOSES)},{exp},R{rnd.randint(1, 40)},"
+                    f"{rnd.choice(MAKERS)}\n")
+
+
+def bench_import(db_path, n_rows):
+    db = MedicineDB(db_path)
+    tmp = os.path.dirname(db_path)
+    source = os.path.join(tmp, "supplier.csv")
+    write_supplier_csv(source, n_rows)
+    print(f"import: {n_rows} new rows from CSV")
+    tracemalloc.start()
+    start = time.perf_counter()
+    imported, errors = db.import_medicines(source)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  imported {imported} ({len(errors)} errors) in {elapsed:.2f} s, "
+          f"{imported / elapsed:,.0f} rows/s, peak {peak / 1e6:.1f} MB")
+    for suffix in (".csv", ".jsonl"):
+        start = time.perf_counter()
+        count = db.export_medicines(os.path.join(tmp, "export" + suffix))
+        print(f"  exported {count} rows to {suffix} in {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    imported, errors = db.import_medicines(os.path.join(tmp, "export.jsonl"))
+    print(f"  re-imported (upsert) {imported} rows from .jsonl in {time.perf_counter() - start:.2f} s")
+    db.conn.close()
+
+
+# ---------------------------
+# UI Responsiveness
+# ---------------------------
+def bench_responsiveness(db_path, n_rows):
+    # Simulates the Tk loop ticking every 5 ms while the DB worker thread runs a bulk
+    # import, and reports how late the ticks were (one frame is ~16 ms). Each tick
+    # refreshes the stock view the way StockPage.refresh_stock does.
+    db = MedicineDB(db_path)
+    source = os.path.join(os.path.dirname(db_path), "supplier.csv")
+    write_supplier_csv(source, n_rows)
+    db.load_catalog()
+    view = TreeviewSync(CountingTreeview(), tuple)
+    worker = threading.Thread(target=db.import_medicines, args=(source,))
+    lateness = []
+    reloads = 0
+    worker.start()
+    while worker.is_alive():
+        start = time.perf_counter()
+        time.sleep(0.005)
+        catalog = db.cached_catalog
+        if catalog is None:
+            reloads += 1  # the page would hand the reload to the worker and show "Loading..."
+        else:
+            with catalog.lock:
+                view.sync(catalog)
+                view.status(catalog)
+        lateness.append((time.perf_counter() - start) * 1000 - 5)
+    lateness.sort()
+    print(f"responsiveness: {len(lateness)} UI ticks during a {n_rows}-row import on the worker "
+          f"({reloads} while the catalog was unloaded)")
+    print(f"  tick lateness ms: p50 {lateness[len(lateness) // 2]:.2f}, "
+          f"p99 {lateness[int(len(lateness) * 0.99)]:.2f}, max {lateness[-1]:.2f}")
+    db.conn.close()
+
+
+# ---------------------------
+# Reorder Planning
+# ---------------------------
+def bench_reorder(db_path, n_skus, repeats):
+    # Gives every SKU a sales velocity (as checkouts would have) and times a full plan.
+    db = MedicineDB(db_path)
+    rnd = random.Random(3)
+    today = (date.today() - date(1970, 1, 1)).days
+    db.conn.executemany("INSERT INTO item_velocity (sl_no, rate, updated_day) VALUES (?,?,?)",
+                        [(sl_no, rnd.expovariate(1 / 20), today - rnd.randint(0, 30))
+                         for sl_no in range(1, n_skus + 1)])
+    db.conn.commit()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        suggestions = db.reorder_suggestions()
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"reorder: {n_skus} SKUs with sales history, {repeats} runs")
+    print(f"  full plan: median {statistics.median(samples):.1f} ms, max {max(samples):.1f} ms, "
+          f"{len(suggestions)} suggestions")
+    db.conn.close()
+
+
+# ---------------------------
+# Login
+# ---------------------------
+def timed_ms(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def bench_login(admin_path, repeats):
+    # Opening AdminDB migrates the plaintext fixture, hashing every password once.
+    start = time.perf_counter()
+    admin = AdminDB(admin_path)
+    print(f"login: migrated admin.db in {(time.perf_counter() - start) * 1000:.0f} ms")
+    for iterations in (50_000, 100_000, PASSWORD_ITERATIONS, 400_000):
+        stored = hash_password("secret", iterations)
+        ms = timed_ms(lambda: verify_password("secret", stored), repeats)
+        marker = "  <- PASSWORD_ITERATIONS" if iterations == PASSWORD_ITERATIONS else ""
+        print(f"  verify @ {iterations:>7} iterations: {ms:7.1f} ms{marker}")
+    for label, username, password in [("valid login", "admin", "admin"),
+                                      ("wrong password", "admin", "nope"),
+                                      ("unknown user", "nobody", "admin")]:
+        ms = timed_ms(lambda: admin.check_login(username, password), repeats)
+        print(f"  check_login {label:<15} {ms:7.1f} ms")
+    session = Session("admin", admin.check_login("admin", "admin"))
+    checks = 100_000
+    start = time.perf_counter()
+    for i in range(checks):
+        session.can(PAGES[i % len(PAGES)])
+    print(f"  cached permission check: {(time.perf_counter() - start) / checks * 1e9:.0f} ns")
+    admin.conn.close()
+
+
+# ---------------------------
+# Profiling Overhead
+# ---------------------------
+def bench_profiling(db_path, repeats):
+    # The same hot paths with the profiler off and installed (MEDICAL_PROFILE=1).
+    results = {}
+    for mode in ("off", "on"):
+        if mode == "on":
+            PROFILER.reset()
+            PROFILER.install()
+        db = MedicineDB(db_path)
+        if mode == "on":
+            PROFILER.instrument_db("medicine.db", db)
+        rnd = random.Random(9)
+        skus = sellable_skus(db)
+        purposes = itertools.cycle(PURPOSES)
+        terms = itertools.cycle(SEARCH_TERMS)
+        db.fetch_all_medicines()
+        cases = [
+            ("get_medicine_by_sl", lambda: db.get_medicine_by_sl(rnd.choice(skus))),
+            ("search_by_symptom", lambda: db.search_by_symptom(next(purposes))),
+            ("search", lambda: db.search(next(terms))),
+            ("checkout_10", lambda: db.checkout([(sl_no, "item", 1, 1.0) for sl_no in rnd.sample(skus, 10)])),
+        ]
+        for name, fn in cases:
+            results.setdefault(name, {})[mode] = measure(fn, repeats)["median_ms"]
+        db.conn.close()
+    recorded = sum(stats["calls"] for stats in PROFILER.snapshot()["calls"].values())
+    PROFILER.uninstall()
+    print(f"profiling: {repeats} runs per case, {recorded} calls and statements recorded while on")
+    print(f"{'case':<22} {'off ms':>9} {'on ms':>9} {'overhead':>9}")
+    for name, modes in results.items():
+        print(f"{name:<22} {modes['off']:>9.3f} {modes['on']:>9.3f} {(modes['on'] - modes['off']) * 1000:>7.0f} us")
+
+
+# ---------------------------
+# Service Load Test
+# ---------------------------
+SERVICE_MIX = [("search", 50), ("catalog", 20), ("expiry", 10), ("checkout", 20)]
+SEARCH_TERMS = ["para", "cillin", "fever", "amox", "zole", "Cipla", "statin", "pain"]
+
+
+def start_service(db_path, readers):
+    ready = threading.Event()
+    started = {}
+
+    def on_start(port, service):
+        started.update(port=port, service=service)
+        ready.set()
+
+    threading.Thread(target=lambda: asyncio.run(serve(db_path, port=0, readers=readers, started=on_start)),
+                     daemon=True).start()
+    ready.wait()
+    return started["port"], started["service"]
+
+
+def service_terminal(port, n_skus, deadline, seed, samples):
+    # One simulated till: a single keep-alive connection issuing requests back to back.
+    rnd = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    ops, weights = zip(*SERVICE_MIX)
+    today = date.today()
+    while time.perf_counter() < deadline:
+        op = rnd.choices(ops, weights)[0]
+        body = None
+        if op == "search":
+            method, path = "GET", f"/search?q={rnd.choice(SEARCH_TERMS)}&limit=20"
+        elif op == "catalog":
+            method, path = "GET", f"/catalog?offset={rnd.randrange(n_skus)}&limit=100"
+        elif op == "expiry":
+            method, path = "GET", f"/expiry?start={today.isoformat()}&end={(today + timedelta(days=30)).isoformat()}"
+        else:
+            items = [(rnd.randint(1, n_skus), "item", 1, 1.0) for _ in range(rnd.randint(1, 5))]
+            method, path, body = "POST", "/checkout", json.dumps({"items": items})
+        start = time.perf_counter()
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        response.read()
+        samples.append((op, (time.perf_counter() - start) * 1000, response.status))
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def bench_service(db_path, n_skus, terminals, seconds, readers):
+    port, service = start_service(db_path, readers)
+    samples = []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=service_terminal, args=(port, n_skus, deadline, seed, samples))
+               for seed in range(terminals)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"service: {terminals} terminals for {seconds}s, {readers} readers, {n_skus} SKUs")
+    print(f"  throughput: {len(samples) / seconds:.0f} req/s, "
+          f"errors: {sum(1 for _, _, status in samples if status >= 500)}")
+    for op, _ in SERVICE_MIX + [("all", 0)]:
+        latencies = sorted(ms for name, ms, _ in samples if op in ("all", name))
+        if latencies:
+            print(f"  {op:<9} {len(latencies):>7} req  p50 {percentile(latencies, 0.5):7.2f} ms  "
+                  f"p99 {percentile(latencies, 0.99):7.2f} ms")
+    writer = service.writer
+    if writer.batches:
+        print(f"  checkout batches: {writer.batches}, {writer.batched_bills / writer.batches:.1f} bills per commit")
+
+
+# ---------------------------
+# Suite & Regression Check
+# ---------------------------
+REGRESSION_FLOOR_MS = 0.5  # slowdowns smaller than this are timer noise, whatever the ratio
+
+
+def measure(fn, repeats, before=None):
+    # before() runs untimed ahead of each call, e.g. to make a change for a refresh to pick up.
+    samples = []
+    for _ in range(repeats):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"median_ms": round(statistics.median(samples), 4), "p95_ms": round(percentile(samples, 0.95), 4),
+            "runs": repeats}
+
+
+def run_suite(db_path, admin_path, repeats):
+    # The hot paths behind each page, timed without Tk.
+    db = MedicineDB(db_path)
+    admin = AdminDB(admin_path)
+    rnd = random.Random(5)
+    skus = sellable_skus(db)
+    purposes = itertools.cycle(PURPOSES)
+    terms = itertools.cycle(SEARCH_TERMS)
+    view = TreeviewSync(CountingTreeview(), tuple, page_size=500)
+
+    def cold_catalog():
+        fresh = MedicineDB(db_path)
+        fresh.fetch_all_medicines()
+        fresh.conn.close()
+
+    def bill_generation():
+        bill = Bill()
+        for sl_no in rnd.sample(skus, 30):
+            row = db.get_medicine_by_sl(sl_no)
+            bill.add(sl_no, row[1], float(row[4]), 1)
+        format_bill((0, datetime.now().isoformat(timespec="seconds"), "", "", bill.total), bill.items())
+
+    def sale():
+        db.checkout([(sl_no, "item", 1, 1.0) for sl_no in rnd.sample(skus, 10)])
+
+    cases = [
+        ("fetch_all_medicines_cold", cold_catalog, min(repeats, 5), None),
+        ("fetch_all_medicines", db.fetch_all_medicines, repeats, None),
+        ("search_by_symptom", lambda: db.search_by_symptom(next(purposes)), repeats, None),
+        ("search", lambda: db.search(next(terms)), repeats, None),
+        ("expiring_within_30", lambda: db.expiring_within(30), repeats, None),
+        ("check_login", lambda: admin.check_login("admin", "admin"), min(repeats, 5), None),
+        ("bill_generation_30", bill_generation, repeats, None),
+        ("checkout_10", sale, repeats, None),
+        ("stock_refresh", lambda: view.sync(db.catalog), repeats, sale),
+        ("dashboard_stats", db.dashboard_stats, repeats, None),
+        ("reorder_suggestions", db.reorder_suggestions, repeats, None),
+    ]
+    view.sync(db.catalog)
+    results = {}
+    print(f"suite: {len(db.catalog)} SKUs, {repeats} runs per case")
+    print(f"{'case':<26} {'median ms':>10} {'p95 ms':>9}")
+    for name, fn, runs, before in cases:
+        results[name] = measure(fn, runs, before)
+        print(f"{name:<26} {results[name]['median_ms']:>10.3f} {results[name]['p95_ms']:>9.3f}")
+    meta = {
+        "skus": len(db.catalog),
+        "repeats": repeats,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "password_iterations": PASSWORD_ITERATIONS,
+    }
+    db.conn.close()
+    admin.conn.close()
+    return {"meta": meta, "results": results}
+
+
+def compare_to_baseline(report, baseline_path, threshold):
+    # Counts cases whose median grew by more than `threshold` times the baseline's.
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"]["skus"] != report["meta"]["skus"]:
+        print(f"warning: baseline has {baseline['meta']['skus']} SKUs, this run {report['meta']['skus']}")
+    regressions = 0
+    print(f"regression check against {baseline_path} (threshold x{threshold})")
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"  {name:<26} new")
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        regressed = ratio > threshold and result["median_ms"] - base["median_ms"] > REGRESSION_FLOOR_MS
+        regressions += regressed
+        print(f"  {name:<26} {base['median_ms']:>10.3f} -> {result['median_ms']:>10.3f} ms  x{ratio:5.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+# ---------------------------
+# Query Plans
+# ---------------------------
+BIG_TABLES = {"med", "lots", "sales", "sale_items", "log"}
+# Read end to end on purpose: the catalog load and the dashboard figures shown before it.
+WHOLE_TABLE_READS = {" ".join(sql.split()) for sql in (CATALOG_SELECT, STOCK_TOTALS_SELECT)}
+
+
+class StatementRecorder(Profiler):
+    # Keeps the connection and first parameters seen for each distinct statement
+    # instead of timings.
+    def reset(self):
+        super().reset()
+        self.executed = {}
+
+    def statement(self, conn, sql, params, ms):
+        self.executed.setdefault(" ".join(sql.split()), (conn, params))
+
+
+def run_workload(db, admin, skus):
+    # One pass over the database calls the pages and the service make.
+    today = date.today()
+    expiry = (today + timedelta(days=90)).strftime("%d/%m/%y")
+    db.dashboard_stats()
+    db.load_catalog()
+    db.dashboard_stats()
+    db.get_medicine_by_sl(skus[0])
+    name = db.get_medicine_by_sl(skus[1])[1]
+    db.find_by_name(name)
+    db.lots_for_name(name)
+    db.search(name[:2])
+    db.search(name[:6])
+    db.expiring_between(today, today + timedelta(days=30))
+    db.expiring_within(30, include_expired=True)
+    db.checkout([(skus[0], "", 1, 1.0), (skus[1], "", 2, 1.0)], "Juan", "Manila")
+    db.checkout_many([([(skus[2], "", 1, 1.0)], "Ana", ""), ([(skus[3], "", 1, 1.0)], "", "")])
+    db.receive_lot(skus[4], "L1", 10, expiry)
+    db.update_medicines([(skus[5], {"cost": "9.50", "exp_date": expiry}, db.get_version(skus[5]))])
+    db.update_quantity(skus[6], 5)
+    db.insert_medicine((None, "Workload 5mg", "Tablet", 5, 1.0, "Fever", expiry, "R1", "Cipla"))
+    db.delete_medicine(skus[7])
+    db.import_records([(1, {"sl_no": skus[8], "name": name, "qty_left": 4, "cost": 2, "exp_date": expiry}),
+                       (2, {"name": "Workload 10mg", "qty_left": 1, "cost": 1})])
+    db.reorder_suggestions()
+    db.get_sale(1)
+    db.sales_between(today, today)
+    db.bills_between(today, today)
+    db.sales_for_customer("Juan")
+    db.sales_of_item(skus[0])
+    admin.check_login("admin", "admin")
+    admin.check_login("nobody", "admin")
+
+
+def full_scans(sql, plan):
+    # Big tables the plan reads end to end. SCAN names the alias when the query gives one.
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?=(\w+)))?", sql, re.IGNORECASE):
+        aliases[alias or table] = table
+    scanned = set()
+    for step in plan:
+        match = re.match(r"SCAN (\w+)", step)
+        if match and "VIRTUAL TABLE" not in step:
+            table = aliases.get(match.group(1), match.group(1))
+            if table in BIG_TABLES:
+                scanned.add(table)
+    return sorted(scanned)
+
+
+def query_plans(db_path, admin_path):
+    # (database, sql, plan steps, big tables scanned) for every statement the workload
+    # executed, so the check follows the code rather than a hand-kept list of queries.
+    recorder = StatementRecorder()
+    db, admin = MedicineDB(db_path), AdminDB(admin_path)
+    names = {db.conn: "medicine", admin.conn: "admin"}
+    skus = sellable_skus(db)
+    recorder.instrument_db("medicine", db)
+    recorder.instrument_db("admin", admin)
+    run_workload(db, admin, skus)
+    plans = []
+    for sql, (conn, params) in recorder.executed.items():
+        if not sql.startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+            continue
+        if params is None:  # executemany: only the shape matters to the planner
+            params = (None,) * sql.count("?")
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        scanned = [] if sql in WHOLE_TABLE_READS else full_scans(sql, plan)
+        plans.append((names[conn], sql, plan, scanned))
+    for conn in names:
+        conn.close()
+    return plans
+
+
+def check_plans(db_path, admin_path):
+    # Fails (non-zero exit) if any statement the app runs scans a big table end to end.
+    failures = 0
+    for name, sql, plan, scanned in query_plans(db_path, admin_path):
+        failures += bool(scanned)
+        print(f"{'FAIL' if scanned else 'ok':>4}  [{name}] {sql}\n      {'; '.join(plan)}")
+    return failures
+
+
+# ---------------------------
+# Entry Point
+# ---------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the Medical Management System.")
+    parser.add_argument("bench", choices=["generate", "suite", "checkout", "refresh", "expiry", "search", "import",
+                                          "responsiveness", "lots", "reorder", "login", "profiling", "service",
+                                          "startup", "bills", "columns", "backup", "plans"])
+    parser.add_argument("--skus", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--expiry-days", type=expiry_span, default=(-60, 1095), metavar="MIN:MAX",
+                        help="expiry spread relative to today for generated SKUs")
+    parser.add_argument("--out", help="generate: directory to write medicine.db and admin.db to")
+    parser.add_argument("--data", help="run against a copy of the databases in this directory (see generate)")
+    parser.add_argument("--json", help="suite: write the results to this file")
+    parser.add_argument("--baseline", help="suite: compare with an earlier --json file; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="suite: allowed slowdown ratio")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--terminals", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.bench == "generate":
+        if not args.out:
+            parser.error("generate needs --out")
+        generate(args.out, args.skus, args.users, args.expiry_days)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "medicine.db")
+        admin_path = os.path.join(tmp, "admin.db")
+        if args.data:
+            shutil.copy(os.path.join(args.data, "medicine.db"), db_path)
+            shutil.copy(os.path.join(args.data, "admin.db"), admin_path)
+            with sqlite3.connect(db_path) as conn:
+                args.skus = conn.execute("SELECT COUNT(*) FROM med").fetchone()[0]
+        else:
+            create_medicine_db(db_path, args.skus, expiry_days=args.expiry_days)
+            create_admin_db(admin_path, args.users)
+        if args.bench == "suite":
+            report = run_suite(db_path, admin_path, args.repeats)
+            if args.json:
+                with open(args.json, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2)
+            if args.baseline and compare_to_baseline(report, args.baseline, args.threshold):
+                sys.exit(1)
+        elif args.bench == "checkout":
+            bench_checkout(db_path, args.skus, [1, 10, 30, 100], args.repeats)
+        elif args.bench == "backup":
+            bench_backup(db_path, args.skus, min(args.rows, 2000))
+        elif args.bench == "columns":
+            bench_columns(db_path, args.skus, min(args.repeats, 10))
+        elif args.bench == "bills":
+            bench_bills(db_path, min(args.rows, 5000), args.repeats)
+        elif args.bench == "refresh":
+            bench_refresh(db_path, args.skus, args.repeats)
+        elif args.bench == "startup":
+            bench_startup(db_path, args.skus, min(args.repeats, 5))
+        elif args.bench == "expiry":
+            bench_expiry(db_path, args.skus, args.repeats)
+        elif args.bench == "search":
+            bench_search(db_path, args.skus, args.repeats)
+        elif args.bench == "import":
+            bench_import(db_path, args.rows)
+        elif args.bench == "responsiveness":
+            bench_responsiveness(db_path, args.rows)
+        elif args.bench == "lots":
+            bench_lots(db_path, min(args.skus, 2000), 4, args.repeats)
+        elif args.bench == "reorder":
+            bench_reorder(db_path, args.skus, args.repeats)
+        elif args.bench == "login":
+            bench_login(admin_path, min(args.repeats, 10))
+        elif args.bench == "profiling":
+            bench_profiling(db_path, args.repeats)
+        elif args.bench == "service":
+            bench_service(db_path, args.skus, args.terminals, args.seconds, args.readers)
+        elif args.bench == "plans":
+            sys.exit(1 if check_plans(db_path, admin_path) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,2402 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import sqlite3
+import sys
 import time
-import random
+import csv
+import hashlib
+import hmac
+import http.client
+import json
+import math
+import operator
+import os
+import queue
+import re
+import threading
+import uuid
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from functools import lru_cache, wraps
+from itertools import compress, islice
+from urllib.parse import urlencode, urlsplit
+from urllib.request import pathname2url
 from datetime import datetime, date, timedelta
 
+# ---------------------------
+# Schema & Migrations
+# ---------------------------
+MED_COLUMNS = ("sl_no", "name", "type", "qty_left", "cost", "purpose", "exp_date", "rack", "mfg")
+MED_SELECT = "SELECT " + ", ".join(MED_COLUMNS) + " FROM med"
+CATALOG_SELECT = "SELECT " + ", ".join(MED_COLUMNS) + ", version FROM med"
+# The dashboard's inventory figures in one pass, for before the catalog is loaded.
+STOCK_TOTALS_SELECT = ("SELECT TOTAL(CAST(qty_left AS INTEGER) * cost), TOTAL(CAST(qty_left AS INTEGER) < ?), "
+                       "TOTAL(exp_day BETWEEN ? AND ?) FROM med")
+SALE_SELECT = "SELECT bill_no, created_at, customer, address, total FROM sales"
+# Per-lot rows shaped like MED_SELECT (lot quantity and expiry in place of the
+# product's) with the lot number appended.
+LOT_SELECT = ("SELECT m.sl_no, m.name, m.type, l.qty, m.cost, m.purpose, l.exp_date, m.rack, m.mfg, l.lot_no "
+              "FROM lots l JOIN med m ON m.sl_no = l.sl_no")
+EPOCH = date(1970, 1, 1)
+
+
+def parse_exp_date(exp_str):
+    # Expiry dates are entered as DD/MM/YY; DD/MM/YYYY is accepted too.
+    for fmt in ("%d/%m/%y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(str(exp_str).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def epoch_day(day):
+    return (day - EPOCH).days
+
+
+def now_iso():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+@lru_cache(maxsize=8192)
+def exp_day_of(exp_str):
+    # Sortable shadow of exp_date stored in med.exp_day (days since 1970-01-01).
+    parsed = parse_exp_date(exp_str)
+    return epoch_day(parsed) if parsed else None
+
+
+def like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def to_int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def has_index_on(conn, table, column):
+    # True if some index (including PRIMARY KEY/UNIQUE autoindexes) leads with `column`.
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        info = conn.execute(f"PRAGMA index_info('{index[1]}')").fetchall()
+        if info and info[0][2] == column:
+            return True
+    return False
+
+
+def run_migrations(conn, migrations):
+    # PRAGMA user_version records how many migrations a database has had applied;
+    # each pending step runs in its own transaction together with the version bump.
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migrate in enumerate(migrations[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+MED_SCHEMA = """
+    CREATE TABLE med (
+        sl_no INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        type TEXT,
+        qty_left INTEGER NOT NULL DEFAULT 0,
+        cost REAL NOT NULL DEFAULT 0,
+        purpose TEXT,
+        exp_date TEXT,
+        rack TEXT,
+        mfg TEXT,
+        exp_day INTEGER
+    )"""
+
+
+def medicine_v1_base_schema(conn):
+    # Create med if missing, otherwise rebuild a legacy all-text table with sl_no as
+    # INTEGER PRIMARY KEY, numeric qty_left/cost and the exp_day shadow filled in.
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='med'").fetchone()
+    if not exists:
+        conn.execute(MED_SCHEMA)
+        return
+    legacy = conn.execute(MED_SELECT + " ORDER BY rowid").fetchall()
+    conn.execute("ALTER TABLE med RENAME TO med_legacy")
+    conn.execute(MED_SCHEMA)
+    seen = set()
+    rows = []
+    for row in legacy:
+        sl_no = to_int(row[0], None)
+        if sl_no in seen:
+            sl_no = None  # duplicate id in the old table; let SQLite allocate a fresh one
+        seen.add(sl_no)
+        rows.append((sl_no, row[1] or "", row[2], to_int(row[3]), to_float(row[4]), row[5],
+                     row[6], row[7], row[8], exp_day_of(row[6])))
+    conn.executemany("INSERT INTO med VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.execute("DROP TABLE med_legacy")
+
+
+def medicine_v2_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_med_purpose ON med(purpose)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_med_name ON med(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_med_exp_day ON med(exp_day)")
+
+
+MED_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS med_fts_insert AFTER INSERT ON med BEGIN
+        INSERT INTO med_fts(rowid, name, purpose, mfg) VALUES (new.sl_no, new.name, new.purpose, new.mfg);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS med_fts_delete AFTER DELETE ON med BEGIN
+        INSERT INTO med_fts(med_fts, rowid, name, purpose, mfg)
+        VALUES ('delete', old.sl_no, old.name, old.purpose, old.mfg);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS med_fts_update AFTER UPDATE OF sl_no, name, purpose, mfg ON med BEGIN
+        INSERT INTO med_fts(med_fts, rowid, name, purpose, mfg)
+        VALUES ('delete', old.sl_no, old.name, old.purpose, old.mfg);
+        INSERT INTO med_fts(rowid, name, purpose, mfg) VALUES (new.sl_no, new.name, new.purpose, new.mfg);
+    END""",
+]
+
+
+def medicine_v3_search_index(conn):
+    # Trigram FTS5 index over name/purpose/mfg kept in sync by triggers, so every
+    # writer (this app, imports, other terminals) updates it. Builds of SQLite
+    # without FTS5 skip it and MedicineDB.search falls back to LIKE.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_med_name_nocase ON med(name COLLATE NOCASE)")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE med_fts USING fts5("
+                     "name, purpose, mfg, content='med', content_rowid='sl_no', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return
+    for trigger in MED_FTS_TRIGGERS:
+        conn.execute(trigger)
+    conn.execute("INSERT INTO med_fts(med_fts) VALUES ('rebuild')")
+
+
+def medicine_v4_sales_ledger(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sales (
+            bill_no INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            sale_day INTEGER NOT NULL,
+            customer TEXT,
+            address TEXT,
+            total REAL NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sale_items (
+            bill_no INTEGER NOT NULL REFERENCES sales(bill_no),
+            sl_no INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            qty INTEGER NOT NULL,
+            price REAL NOT NULL,
+            PRIMARY KEY (bill_no, sl_no)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_day ON sales(sale_day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer ON sales(customer COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sl_no ON sale_items(sl_no)")
+
+
+def medicine_v5_sales_aggregates(conn):
+    # Running per-day and per-SKU sales totals, maintained by checkout, so the
+    # dashboard never aggregates the full sales history.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            sale_day INTEGER PRIMARY KEY,
+            bills INTEGER NOT NULL,
+            revenue REAL NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS item_sales (
+            sl_no INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            qty_sold INTEGER NOT NULL,
+            revenue REAL NOT NULL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_item_sales_qty ON item_sales(qty_sold)")
+    conn.execute("INSERT INTO daily_sales SELECT sale_day, COUNT(*), SUM(total) FROM sales GROUP BY sale_day")
+    conn.execute("INSERT INTO item_sales SELECT sl_no, MAX(name), SUM(qty), SUM(qty * price) "
+                 "FROM sale_items GROUP BY sl_no")
+
+
+def medicine_v6_row_versions(conn):
+    # Bumped on every write to a row; edits check it to detect concurrent changes.
+    conn.execute("ALTER TABLE med ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def medicine_v7_sales_velocity(conn):
+    # Exponentially decayed units/day per SKU, updated by checkout; seeded from the ledger.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS item_velocity (
+            sl_no INTEGER PRIMARY KEY,
+            rate REAL NOT NULL,
+            updated_day INTEGER NOT NULL
+        )""")
+    today = epoch_day(date.today())
+    conn.execute("INSERT INTO item_velocity (sl_no, rate, updated_day) "
+                 "SELECT i.sl_no, SUM(i.qty * (1 - :decay) * pow(:decay, :today - s.sale_day)), :today "
+                 "FROM sale_items i JOIN sales s ON s.bill_no = i.bill_no GROUP BY i.sl_no",
+                 {"decay": VELOCITY_DECAY, "today": today})
+
+
+# A product's qty_left is the total over its lots and exp_date/exp_day follow the
+# earliest expiry among the lots still in stock.
+FILL_MISSING_LOTS = """
+    INSERT INTO lots (sl_no, qty, exp_date, exp_day, received_at)
+    SELECT sl_no, qty_left, exp_date, exp_day, ? FROM med m
+    WHERE qty_left > 0 AND NOT EXISTS (SELECT 1 FROM lots l WHERE l.sl_no = m.sl_no)"""
+NEXT_LOT_EXPIRY = """
+    exp_date = COALESCE((SELECT exp_date FROM lots l WHERE l.sl_no = med.sl_no AND l.qty > 0
+                         ORDER BY l.exp_day IS NULL, l.exp_day LIMIT 1), exp_date),
+    exp_day = COALESCE((SELECT exp_day FROM lots l WHERE l.sl_no = med.sl_no AND l.qty > 0
+                        ORDER BY l.exp_day IS NULL, l.exp_day LIMIT 1), exp_day)"""
+
+
+def medicine_v8_lots(conn):
+    # Stock arrives in lots with their own expiry; existing stock becomes one lot per
+    # product. sale_lots records which lots each bill line was taken from.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lots (
+            lot_id INTEGER PRIMARY KEY,
+            sl_no INTEGER NOT NULL,
+            lot_no TEXT,
+            qty INTEGER NOT NULL,
+            exp_date TEXT,
+            exp_day INTEGER,
+            received_at TEXT NOT NULL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lots_fefo ON lots(sl_no, exp_day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lots_exp_day ON lots(exp_day)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sale_lots (
+            bill_no INTEGER NOT NULL,
+            lot_id INTEGER NOT NULL,
+            sl_no INTEGER NOT NULL,
+            qty INTEGER NOT NULL,
+            PRIMARY KEY (bill_no, lot_id)
+        )""")
+    conn.execute(FILL_MISSING_LOTS, (now_iso(),))
+
+
+MEDICINE_MIGRATIONS = [
+    medicine_v1_base_schema,
+    medicine_v2_indexes,
+    medicine_v3_search_index,
+    medicine_v4_sales_ledger,
+    medicine_v5_sales_aggregates,
+    medicine_v6_row_versions,
+    medicine_v7_sales_velocity,
+    medicine_v8_lots,
+]
+
+
+def admin_v1_base_schema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS log (username TEXT PRIMARY KEY, password TEXT NOT NULL)")
+    if not has_index_on(conn, "log", "username"):
+        conn.execute("CREATE INDEX idx_log_username ON log(username)")
+
+
+def admin_v2_hashed_credentials(conn):
+    # Roles were inferred from the username; passwords (and VC ids) were stored as-is.
+    conn.execute("ALTER TABLE log ADD COLUMN role TEXT NOT NULL DEFAULT 'customer'")
+    conn.execute("UPDATE log SET role='admin' WHERE lower(username)='admin'")
+    rows = conn.execute("SELECT rowid, password FROM log").fetchall()
+    conn.executemany("UPDATE log SET password=? WHERE rowid=?",
+                     [(hash_password(password), rowid) for rowid, password in rows
+                      if not is_password_hash(password)])
+
+
+ADMIN_MIGRATIONS = [
+    admin_v1_base_schema,
+    admin_v2_hashed_credentials,
+]
+
+
+# ---------------------------
+# Authentication
+# ---------------------------
+# Stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>". Raising the iteration
+# count only affects new hashes; older ones are upgraded on the next successful login.
+PASSWORD_SCHEME = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 200_000
+
+PAGES = ("DashboardPage", "StockPage", "BillingPage", "SearchPage", "ExpiryCheckPage", "DiagnosticsPage",
+         "BackupPage")
+# Narrow a role's set to hide pages from it.
+ROLE_PERMISSIONS = {
+    "admin": frozenset(PAGES),
+    "customer": frozenset(PAGES) - {"DiagnosticsPage", "BackupPage"},
+}
+
+
+def hash_password(password, iterations=None, salt=None):
+    iterations = iterations or PASSWORD_ITERATIONS
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_password_hash(stored):
+    return stored.startswith(PASSWORD_SCHEME + "$") and stored.count("$") == 3
+
+
+def verify_password(password, stored):
+    if not is_password_hash(stored):
+        return False
+    _, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
+def needs_rehash(stored):
+    return int(stored.split("$")[1]) != PASSWORD_ITERATIONS
+
+
+@lru_cache(maxsize=1)
+def dummy_hash():
+    # Verified against for unknown usernames so they cost as much as a wrong password.
+    return hash_password("")
+
+
+class Session:
+    # Resolved once at login; page and permission checks afterwards are set lookups
+    # and never go back to admin.db.
+    def __init__(self, username, role):
+        self.username = username
+        self.role = role
+        self.permissions = ROLE_PERMISSIONS.get(role, frozenset())
+        self.started_at = datetime.now()
+
+    def can(self, permission):
+        return permission in self.permissions
+
+
+# ---------------------------
+# Reorder Planning
+# ---------------------------
+# Sales velocity is an exponentially weighted average of units sold per day: each
+# day's sales count for half as much after VELOCITY_HALF_LIFE_DAYS. A SKU is due for
+# reorder once its stock would not last the supplier lead time plus a safety margin,
+# and the suggested order brings it up to cover the following review period as well.
+VELOCITY_HALF_LIFE_DAYS = 14
+VELOCITY_DECAY = 0.5 ** (1 / VELOCITY_HALF_LIFE_DAYS)
+MIN_VELOCITY = 0.01  # below this (about one unit in 100 days) a SKU is not forecast
+LEAD_TIME_DAYS = 7
+SAFETY_DAYS = 3
+REVIEW_DAYS = 14
+REORDER_COLUMNS = ("sl_no", "name", "qty_left", "velocity", "days_of_cover", "reorder_point", "order_qty")
+
+# One set-based pass over item_velocity joined to med; SQLite does the per-SKU
+# arithmetic, so a 100k-SKU catalog is planned without a Python loop per row.
+REORDER_SELECT = """
+    SELECT sl_no, name, qty_left, velocity, qty_left / velocity,
+           velocity * (:lead + :safety), velocity * (:lead + :safety + :review) - qty_left
+    FROM (SELECT m.sl_no, m.name, m.qty_left, v.rate * pow(:decay, :today - v.updated_day) AS velocity
+          FROM item_velocity v JOIN med m ON m.sl_no = v.sl_no)
+    WHERE velocity >= :min_velocity AND qty_left <= velocity * (:lead + :safety)
+    ORDER BY qty_left / velocity"""
+
+
+def write_purchase_list(path, suggestions):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REORDER_COLUMNS)
+        for sl_no, name, qty_left, velocity, cover, reorder_point, order_qty in suggestions:
+            writer.writerow((sl_no, name, qty_left, f"{velocity:.2f}", f"{cover:.1f}",
+                             math.ceil(reorder_point), order_qty))
+    return len(suggestions)
+
+
+# ---------------------------
+# Backup & Restore
+# ---------------------------
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7  # snapshots kept per database; older ones are deleted
+BACKUP_PAGES_PER_STEP = 256  # 1 MiB per step at SQLite's default 4 KiB pages
+BACKUP_STEP_SLEEP = 0.005  # seconds between steps, leaving the disk to billing
+BACKUP_INTERVAL_MS = 4 * 60 * 60 * 1000
+
+
+def snapshot_database(db_path, dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, progress=None):
+    # Online copy through SQLite's backup API on a connection of its own. One read
+    # transaction spans every step, so the copy is a single point in time and, under
+    # WAL, writers carry on meanwhile (without it a commit between steps would make
+    # SQLite restart the copy). Written to .part and renamed when complete.
+    part = dest_path + ".part"
+    if os.path.exists(part):
+        os.remove(part)
+
+    def step_done(status, remaining, total):
+        # Connection.backup's own sleep only applies when a step finds the source busy.
+        if progress is not None:
+            progress(status, remaining, total)
+        if remaining and sleep:
+            time.sleep(sleep)
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(part)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=step_done)
+        target.execute("PRAGMA journal_mode=DELETE")  # a self-contained single file
+    finally:
+        source.close()
+        target.close()
+    os.replace(part, dest_path)
+    return dest_path
+
+
+def list_snapshots(db_path, backup_dir=BACKUP_DIR):
+    # Snapshot paths of one database, newest first.
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    pattern = re.compile(re.escape(stem) + r"-\d{8}-\d{6}\.db")
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return []
+    return sorted((os.path.join(backup_dir, name) for name in names if pattern.fullmatch(name)), reverse=True)
+
+
+def backup_database(db_path, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, **steps):
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    path = snapshot_database(db_path, os.path.join(backup_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db"),
+                             **steps)
+    for old in list_snapshots(db_path, backup_dir)[keep:]:
+        os.remove(old)
+    return path
+
+
+def open_snapshot(path):
+    # Read-only, so a missing file is an error rather than a new empty database.
+    return sqlite3.connect("file:" + pathname2url(os.path.abspath(path)) + "?mode=ro", uri=True)
+
+
+def check_integrity(path):
+    # [] if PRAGMA integrity_check passes, otherwise the problems it reports.
+    conn = open_snapshot(path)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if problems == ["ok"] else problems
+
+
+def restore_database(conn, snapshot_path):
+    # Replaces the live database behind `conn` with a checked snapshot in a single
+    # backup step; other connections see the restored data on their next read.
+    problems = check_integrity(snapshot_path)
+    if problems:
+        raise ValueError(f"{os.path.basename(snapshot_path)} failed its integrity check: {problems[0]}")
+    source = open_snapshot(snapshot_path)
+    try:
+        if source.execute("PRAGMA user_version").fetchone()[0] == 0:
+            raise ValueError(f"{os.path.basename(snapshot_path)} is not a snapshot of a store database.")
+        source.backup(getattr(conn, "_conn", conn))  # the real connection under an InstrumentedConnection
+    finally:
+        source.close()
+
+
 # ---------------------------
 # Database Handler Classes
 # ---------------------------
+def open_connection(db_path):
+    # Shared by the UI thread and the DB worker (serialised by each handler's lock).
+    # WAL lets readers on other connections/terminals proceed while a write commits.
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        conn.execute("SELECT pow(2, 1)")
+    except sqlite3.OperationalError:
+        conn.create_function("pow", 2, math.pow, deterministic=True)  # SQLite built without math functions
+    return conn
+
+
+def locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class AdminDB:
     def __init__(self, db_path="admin.db"):
-        self.conn = sqlite3.connect(db_path)
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = open_connection(db_path)
+        run_migrations(self.conn, ADMIN_MIGRATIONS)
         self.cursor = self.conn.cursor()
 
-    def check_login(self, username, password):
-        self.cursor.execute("SELECT * FROM log WHERE username=? AND password=?", (username, password))
+    def backup(self, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        return backup_database(self.db_path, backup_dir, keep)
+
+    @locked
+    def restore(self, snapshot_path):
+        restore_database(self.conn, snapshot_path)
+        run_migrations(self.conn, ADMIN_MIGRATIONS)
+
+    @locked
+    def get_credentials(self, username):
+        self.cursor.execute("SELECT password, role FROM log WHERE username=?", (username,))
         return self.cursor.fetchone()
 
-    def insert_valued_customer(self, name, address, vc_id):
-        self.cursor.execute("INSERT INTO log (username, password) VALUES (?,?)", (name, vc_id))
+    @locked
+    def set_password(self, username, password_hash):
+        self.cursor.execute("UPDATE log SET password=? WHERE username=?", (password_hash, username))
         self.conn.commit()
 
+    def check_login(self, username, password):
+        # Returns the user's role, or None. Hashing is slow on purpose, so it runs
+        # outside the lock (and, from the UI, on the DB worker).
+        row = self.get_credentials(username)
+        if row is None:
+            verify_password(password, dummy_hash())
+            return None
+        stored, role = row
+        if not verify_password(password, stored):
+            return None
+        if needs_rehash(stored):
+            self.set_password(username, hash_password(password))
+        return role
+
+    def insert_valued_customer(self, name, address, vc_id):
+        password_hash = hash_password(vc_id)
+        with self.lock:
+            self.cursor.execute("INSERT INTO log (username, password, role) VALUES (?,?,'customer')",
+                                (name, password_hash))
+            self.conn.commit()
+
+
+def normalize_field(column, value):
+    # Coerces an edited value to the column's stored type; rejects unknown columns.
+    if column not in MED_COLUMNS[1:]:
+        raise ValueError(f"Unknown column {column!r}")
+    if column == "qty_left":
+        qty = to_int(value, None)
+        if qty is None or qty < 0:
+            raise ValueError(f"Invalid quantity {value!r}")
+        return qty
+    if column == "cost":
+        cost = to_float(value, None)
+        if cost is None or cost < 0:
+            raise ValueError(f"Invalid cost {value!r}")
+        return cost
+    value = str(value).strip()
+    if column == "name" and not value:
+        raise ValueError("Name is required")
+    if column == "exp_date" and value and parse_exp_date(value) is None:
+        raise ValueError(f"Invalid expiry date {value!r} (expected DD/MM/YY)")
+    return value
+
+
+def validate_medicine(record):
+    # Turns an import record (dict keyed by MED_COLUMNS) into a med row plus exp_day.
+    # sl_no may be blank, in which case SQLite allocates one.
+    if not isinstance(record, dict):
+        raise ValueError(f"expected an object with {', '.join(MED_COLUMNS[1:])}, got {type(record).__name__}")
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    sl_no = record.get("sl_no")
+    if sl_no in (None, ""):
+        sl_no = None
+    else:
+        sl_no = to_int(sl_no, None)
+        if sl_no is None or sl_no <= 0:
+            raise ValueError(f"invalid sl_no {record.get('sl_no')!r}")
+    qty = to_int(record.get("qty_left"), None)
+    if qty is None or qty < 0:
+        raise ValueError(f"invalid qty_left {record.get('qty_left')!r}")
+    cost = to_float(record.get("cost"), None)
+    if cost is None or cost < 0:
+        raise ValueError(f"invalid cost {record.get('cost')!r}")
+    exp_date = str(record.get("exp_date") or "").strip()
+    exp_day = exp_day_of(exp_date) if exp_date else None
+    if exp_date and exp_day is None:
+        raise ValueError(f"invalid exp_date {exp_date!r} (expected DD/MM/YY)")
+    return (sl_no, name, record.get("type") or "", qty, cost, record.get("purpose") or "",
+            exp_date, record.get("rack") or "", record.get("mfg") or "", exp_day)
+
+
+def read_medicine_file(path):
+    # Lazily yields (line_no, record) from a CSV file with a MED_COLUMNS header or a
+    # JSON Lines file (.json/.jsonl, one object per line). A line that is not valid JSON
+    # yields a ValueError in place of the record so the rest of the file still imports.
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for record in csv.DictReader(f):
+                yield None, record
+        return
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if line_no == 1 and line.startswith("["):
+                raise ValueError("JSON imports must be JSON Lines (one object per line), not an array")
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                record = ValueError(f"invalid JSON: {e.msg} at column {e.colno}")
+            yield line_no, record
+
+
+def catalog_key(sl_no):
+    # Treeview values come back as strings; normalise so "12" and 12 hit the same entry.
+    try:
+        return int(sl_no)
+    except (TypeError, ValueError):
+        return sl_no
+
+
+class MedicineCatalog:
+    # In-memory copy of the med table keyed by sl_no, with secondary maps by name and
+    # purpose and inventory counters that every put/remove adjusts by one row.
+    JOURNAL_SIZE = 10000
+    LOW_STOCK_LEVEL = 10
+
+    def __init__(self, rows=()):
+        self.rows = {}
+        self.by_name = {}
+        self.by_purpose = {}
+        self.stock_value = 0.0
+        self.low_stock = 0
+        self.expiry_counts = {}  # exp_day -> number of products
+        self.row_versions = {}  # sl_no -> med.version, for optimistic edits
+        self.version = 0
+        self._journal = None
+        self._derived = {}  # name -> (version, value) for lists several pages share
+        # Held by put/remove and by the Tk thread while it reads; never across a query,
+        # so the UI does not wait on the database lock.
+        self.lock = threading.RLock()
+        for row in rows:
+            self.put(row[:9], row[9] if len(row) > 9 else 0)
+        # Every later put/remove bumps the version and records the key, so views
+        # can ask which rows changed since they last looked.
+        self._journal = deque(maxlen=self.JOURNAL_SIZE)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @locked
+    def put(self, row, row_version=0):
+        key = catalog_key(row[0])
+        old = self.rows.get(key)
+        if old is not None:
+            self._unlink(key, old)
+        self.rows[key] = tuple(row)
+        self.row_versions[key] = row_version
+        self.by_name.setdefault(row[1], {})[key] = None
+        self.by_purpose.setdefault(row[5], {})[key] = None
+        self._count(row, 1)
+        self._record(key)
+
+    @locked
+    def remove(self, sl_no):
+        key = catalog_key(sl_no)
+        old = self.rows.pop(key, None)
+        if old is not None:
+            self._unlink(key, old)
+            del self.row_versions[key]
+            self._record(key)
+
+    def _record(self, key):
+        if self._journal is not None:
+            self.version += 1
+            self._journal.append((self.version, key))
+
+    def changes_since(self, version):
+        # Keys touched after `version`, or None if the journal no longer reaches back that
+        # far or `version` is one this catalog has not reached (it came from another one).
+        if version == self.version:
+            return set()
+        if version > self.version:
+            return None
+        if not self._journal or self._journal[0][0] > version + 1:
+            return None
+        changed = set()
+        for entry_version, key in reversed(self._journal):
+            if entry_version <= version:
+                break
+            changed.add(key)
+        return changed
+
+    def window(self, start, count):
+        return list(islice(self.rows.values(), start, start + count))
+
+    def _count(self, row, sign):
+        qty = to_int(row[3])
+        self.stock_value += sign * qty * to_float(row[4])
+        if qty < self.LOW_STOCK_LEVEL:
+            self.low_stock += sign
+        day = exp_day_of(row[6])
+        if day is not None:
+            self.expiry_counts[day] = self.expiry_counts.get(day, 0) + sign
+
+    def expiring_count(self, days):
+        today = epoch_day(date.today())
+        return sum(self.expiry_counts.get(day, 0) for day in range(today, today + days + 1))
+
+    def _unlink(self, key, row):
+        self._count(row, -1)
+        for index, value in ((self.by_name, row[1]), (self.by_purpose, row[5])):
+            keys = index.get(value)
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del index[value]
+
+    def get(self, sl_no):
+        return self.rows.get(catalog_key(sl_no))
+
+    def all(self):
+        return list(self.rows.values())
+
+    def row_version(self, sl_no):
+        return self.row_versions.get(catalog_key(sl_no))
+
+    @locked
+    def get_with_version(self, sl_no):
+        # The row and the version it was written at, read together for an edit form.
+        key = catalog_key(sl_no)
+        return self.rows.get(key), self.row_versions.get(key)
+
+    def with_name(self, name):
+        return [self.rows[key] for key in self.by_name.get(name, ())]
+
+    def with_purpose(self, purpose):
+        return [self.rows[key] for key in self.by_purpose.get(purpose, ())]
+
+    def derived(self, name, build):
+        # build() runs again only after the catalog has changed.
+        cached = self._derived.get(name)
+        if cached is None or cached[0] != self.version:
+            cached = self._derived[name] = (self.version, build())
+        return cached[1]
+
+    def names(self):
+        return self.derived("names", lambda: list(self.by_name))
+
+    def purposes(self):
+        return self.derived("purposes", lambda: sorted(self.by_purpose))
+
+    def columns(self):
+        return self.derived("columns", lambda: CatalogColumns(self.rows.values()))
+
+
+class CatalogColumns:
+    # Read-only column-wise snapshot of the catalog for analytics: typed arrays for
+    # the numbers and small integer codes for the repeated text columns. Filters are
+    # byte masks (1 = row selected); filters and totals loop in C via map/compress,
+    # only grouping walks the rows in Python.
+    CATEGORICAL = {"type": 2, "purpose": 5, "rack": 7, "mfg": 8}
+    NUMERIC = ("sl_no", "qty", "cost", "exp_day")
+    NO_EXPIRY = 2 ** 31 - 1  # exp_day of rows without a parseable date; sorts after every real one
+
+    def __init__(self, rows):
+        self.sl_no = array("q")
+        self.qty = array("q")
+        self.cost = array("d")
+        self.exp_day = array("i")
+        self.names = []
+        self.categories = {column: [] for column in self.CATEGORICAL}  # code -> value
+        # One byte per row while a column has at most 256 values, widened otherwise.
+        self.codes = {column: array("B") for column in self.CATEGORICAL}
+        lookup = {column: {} for column in self.CATEGORICAL}
+        exp_days = {}
+        for row in rows:
+            self.sl_no.append(row[0])
+            self.names.append(row[1])
+            self.qty.append(to_int(row[3]))
+            self.cost.append(to_float(row[4]))
+            day = exp_days.get(row[6])
+            if day is None:
+                day = exp_days[row[6]] = exp_day_of(row[6])
+                if day is None:
+                    day = exp_days[row[6]] = self.NO_EXPIRY
+            self.exp_day.append(day)
+            for column, index in self.CATEGORICAL.items():
+                codes = lookup[column]
+                code = codes.get(row[index])
+                if code is None:
+                    code = codes[row[index]] = len(codes)
+                    self.categories[column].append(row[index])
+                    if code == 256:
+                        self.codes[column] = array("I", self.codes[column])
+                self.codes[column].append(code)
+        self._lookup = lookup
+
+    def __len__(self):
+        return len(self.sl_no)
+
+    def nbytes(self):
+        # Array buffers only; the names list and category values are not counted.
+        arrays = [self.sl_no, self.qty, self.cost, self.exp_day, *self.codes.values()]
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def equals(self, column, value):
+        code = self._lookup[column].get(value)
+        if code is None:
+            return bytes(len(self))
+        codes = self.codes[column]
+        if codes.typecode == "B":
+            # Byte codes map straight onto a 0/1 mask with one translate.
+            return codes.tobytes().translate(bytes(256)[:code] + b"\x01" + bytes(255 - code))
+        return bytes(map(code.__eq__, codes))
+
+    def between(self, column, low=None, high=None):
+        # Rows with low <= column <= high; either bound may be left open.
+        values = getattr(self, column)
+        # Bounds take the column's type: the bound's own comparison method is mapped
+        # over the values, and int.__le__(float) is NotImplemented rather than a bool.
+        if values.typecode == "d":
+            low, high = (None if bound is None else float(bound) for bound in (low, high))
+        else:
+            low = None if low is None else math.ceil(low)
+            high = None if high is None else math.floor(high)
+        if low is not None and high is not None:
+            return bytes(map(operator.and_, map(low.__le__, values), map(high.__ge__, values)))
+        if low is not None:
+            return bytes(map(low.__le__, values))
+        if high is not None:
+            return bytes(map(high.__ge__, values))
+        return b"\x01" * len(self)
+
+    @staticmethod
+    def both(*masks):
+        result = masks[0]
+        for mask in masks[1:]:
+            result = bytes(map(operator.and_, result, mask))
+        return result
+
+    @staticmethod
+    def count(mask):
+        return mask.count(1)
+
+    def select(self, column, mask):
+        values = self.names if column == "name" else getattr(self, column)
+        return list(compress(values, mask))
+
+    def total(self, column, mask=None):
+        values = getattr(self, column)
+        return math.fsum(values if mask is None else compress(values, mask))
+
+    def stock_value(self, mask=None):
+        if mask is None:
+            return math.fsum(map(operator.mul, self.qty, self.cost))
+        return math.fsum(map(operator.mul, compress(self.qty, mask), compress(self.cost, mask)))
+
+    def stock_value_by(self, column, mask=None):
+        # {category value: qty * cost summed over the (selected) rows in it}
+        totals = [0.0] * len(self.categories[column])
+        rows = zip(self.codes[column], map(operator.mul, self.qty, self.cost))
+        for code, value in (rows if mask is None else compress(rows, mask)):
+            totals[code] += value
+        return dict(zip(self.categories[column], totals))
+
 
 class MedicineDB:
+    BULK_IMPORT_BYTES = 1024 * 1024  # larger imports rebuild the search index once at the end
+
     def __init__(self, db_path="medicine.db"):
-        self.conn = sqlite3.connect(db_path)
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = open_connection(db_path)
+        run_migrations(self.conn, MEDICINE_MIGRATIONS)
         self.cursor = self.conn.cursor()
+        self._catalog = None
+        self._data_version = None  # PRAGMA data_version when the catalog was scanned
+        self._check_search_index()
+
+    def _check_search_index(self):
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name='med_fts'")
+        self.has_search_index = self.cursor.fetchone() is not None
+        self.finish_bulk_import()  # in case a bulk import was interrupted
+
+    def backup(self, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        # Not locked: the copy reads through its own connection, so billing carries on.
+        return backup_database(self.db_path, backup_dir, keep)
+
+    @locked
+    def restore(self, snapshot_path):
+        restore_database(self.conn, snapshot_path)
+        run_migrations(self.conn, MEDICINE_MIGRATIONS)  # the snapshot may predate a migration
+        self._check_search_index()
+        self._catalog = None
+
+    @locked
+    def _suspend_search_index(self):
+        # Per-row trigram indexing dominates bulk imports; a single rebuild afterwards
+        # is an order of magnitude cheaper.
+        for name in ("med_fts_insert", "med_fts_delete", "med_fts_update"):
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        self.conn.commit()
+
+    @locked
+    def _resume_search_index(self):
+        for trigger in MED_FTS_TRIGGERS:
+            self.cursor.execute(trigger)
+        self.cursor.execute("INSERT INTO med_fts(med_fts) VALUES ('rebuild')")
+        self.conn.commit()
 
+    @locked
+    def finish_bulk_import(self):
+        # Rebuilds the search index if bulk imports left its triggers suspended.
+        if not self.has_search_index:
+            return
+        self.cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE 'med_fts_%'")
+        if self.cursor.fetchone()[0] < len(MED_FTS_TRIGGERS):
+            self._resume_search_index()
+
+    @property
+    def catalog_loaded(self):
+        return self._catalog is not None
+
+    @property
+    def cached_catalog(self):
+        # For the Tk thread: the loaded catalog or None, without touching the database lock.
+        return self._catalog
+
+    @locked
+    def load_catalog(self):
+        return self.catalog
+
+    @property
+    @locked
+    def catalog(self):
+        # Built from a single scan on first use; the write methods below keep it current.
+        # A commit from another connection (another terminal on medicine.db) changes
+        # data_version, and the catalog is scanned again.
+        self.cursor.execute("PRAGMA data_version")
+        data_version = self.cursor.fetchone()[0]
+        if self._catalog is None or data_version != self._data_version:
+            self.cursor.execute(CATALOG_SELECT)
+            self._catalog = MedicineCatalog(self.cursor.fetchall())
+            self._data_version = data_version
+        return self._catalog
+
+    def _reload_cached(self, sl_no):
+        if self._catalog is None:
+            return
+        self.cursor.execute(CATALOG_SELECT + " WHERE sl_no=?", (sl_no,))
+        row = self.cursor.fetchone()
+        if row is None:
+            self._catalog.remove(sl_no)
+        else:
+            self._catalog.put(row[:9], row[9])
+
+    @locked
     def fetch_all_medicines(self):
-        self.cursor.execute("SELECT * FROM med")
-        return self.cursor.fetchall()
+        return self.catalog.all()
 
+    @locked
     def insert_medicine(self, data):
-        # data should be a tuple with 9 items
-        self.cursor.execute("INSERT INTO med VALUES (?,?,?,?,?,?,?,?,?)", data)
+        # data should be a tuple with 9 items, as typed into a form; each field is coerced
+        # to its column's type and a bad one raises ValueError before anything is written.
+        if len(data) != len(MED_COLUMNS):
+            raise ValueError(f"Expected {len(MED_COLUMNS)} fields, got {len(data)}")
+        sl_no = data[0]
+        if sl_no not in (None, ""):
+            sl_no = to_int(sl_no, None)
+            if sl_no is None or sl_no <= 0:
+                raise ValueError(f"Invalid product ID {data[0]!r}")
+        row = (sl_no or None,) + tuple(normalize_field(column, "" if value is None else value)
+                                       for column, value in zip(MED_COLUMNS[1:], data[1:]))
+        self.cursor.execute("INSERT INTO med (" + ", ".join(MED_COLUMNS) + ", exp_day) "
+                            "VALUES (?,?,?,?,?,?,?,?,?,?)", row + (exp_day_of(row[6]),))
+        sl_no = self.cursor.lastrowid
+        self.cursor.execute(FILL_MISSING_LOTS + " AND m.sl_no = ?", (now_iso(), sl_no))
         self.conn.commit()
+        self._reload_cached(sl_no)
 
+    @locked
     def delete_medicine(self, sl_no):
         self.cursor.execute("DELETE FROM med WHERE sl_no=?", (sl_no,))
+        self.cursor.execute("DELETE FROM lots WHERE sl_no=?", (sl_no,))
         self.conn.commit()
+        if self._catalog is not None:
+            self._catalog.remove(sl_no)
 
+    @locked
     def update_medicine(self, field, new_value, sl_no):
-        sql = f"UPDATE med SET {field} = ? WHERE sl_no = ?"
-        self.cursor.execute(sql, (new_value, sl_no))
+        self.update_medicines([(sl_no, {field: new_value}, None)])
+
+    @locked
+    def get_version(self, sl_no):
+        return self.catalog.row_version(sl_no)
+
+    @locked
+    def get_medicine_with_version(self, sl_no):
+        return self.catalog.get_with_version(sl_no)
+
+    @locked
+    def update_medicines(self, updates):
+        # updates: iterable of (sl_no, {column: value}, expected_version). Only columns
+        # whose value actually changes are written, one UPDATE per row, all in one
+        # transaction. A row whose version no longer matches expected_version (None
+        # skips the check) aborts the whole batch with ConcurrentModification.
+        catalog = self.catalog
+        statements = {}
+        touched = []
+        restock = []  # (sl_no, expiry changed) for rows whose lots must follow the edit
+        for sl_no, changes, expected in updates:
+            current = catalog.get(sl_no)
+            if current is None:
+                raise KeyError(f"No product with ID {sl_no}")
+            values = {}
+            for column, value in changes.items():
+                value = normalize_field(column, value)
+                if value != current[MED_COLUMNS.index(column)]:
+                    values[column] = value
+            if not values:
+                continue
+            if "exp_date" in values:
+                values["exp_day"] = exp_day_of(values["exp_date"])
+            columns = tuple(values)
+            sql = ("UPDATE med SET " + ", ".join(f"{col} = ?" for col in columns) + ", version = version + 1 "
+                   "WHERE sl_no = ?" + ("" if expected is None else " AND version = ?"))
+            params = tuple(values.values()) + (catalog_key(sl_no),) + (() if expected is None else (expected,))
+            statements.setdefault(sql, []).append(params)
+            touched.append((catalog_key(sl_no), expected))
+            if "qty_left" in values or "exp_date" in values:
+                restock.append((catalog_key(sl_no), "exp_date" in values))
+        if not touched:
+            return 0
+        try:
+            updated = 0
+            for sql, params in statements.items():
+                self.cursor.executemany(sql, params)
+                updated += self.cursor.rowcount
+            if updated != len(touched):
+                self.conn.rollback()
+                raise ConcurrentModification(self._find_conflicts(touched))
+            for key, expiry_changed in restock:
+                self._reconcile_lots(key, expiry_changed)
+        except (sqlite3.Error, ValueError):
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        for key, _ in touched:
+            self._reload_cached(key)
+        return updated
+
+    def _reconcile_lots(self, sl_no, expiry_changed):
+        # Brings a product's lots in line with a direct edit of qty_left/exp_date: extra
+        # stock becomes an ADJUST lot, missing stock is written off earliest expiry
+        # first, and a new expiry date applies to the product's only lot in stock.
+        self.cursor.execute("SELECT qty_left, exp_date, exp_day FROM med WHERE sl_no=?", (sl_no,))
+        qty_left, exp_date, exp_day = self.cursor.fetchone()
+        self.cursor.execute("SELECT lot_id, qty FROM lots WHERE sl_no=? AND qty > 0 "
+                            "ORDER BY exp_day IS NULL, exp_day, lot_id", (sl_no,))
+        lots = self.cursor.fetchall()
+        if expiry_changed and lots:
+            if len(lots) > 1:
+                raise ValueError(f"Product {sl_no} has {len(lots)} lots in stock; "
+                                 "receive a new lot instead of changing its expiry date")
+            self.cursor.execute("UPDATE lots SET exp_date=?, exp_day=? WHERE lot_id=?",
+                                (exp_date, exp_day, lots[0][0]))
+        missing = qty_left - sum(qty for _, qty in lots)
+        if missing > 0:
+            self.cursor.execute("INSERT INTO lots (sl_no, lot_no, qty, exp_date, exp_day, received_at) "
+                                "VALUES (?, 'ADJUST', ?, ?, ?, ?)", (sl_no, missing, exp_date, exp_day, now_iso()))
+        for lot_id, qty in lots:
+            if missing >= 0:
+                break
+            take = min(qty, -missing)
+            self.cursor.execute("UPDATE lots SET qty = qty - ? WHERE lot_id=?", (take, lot_id))
+            missing += take
+        self.cursor.execute("UPDATE med SET " + NEXT_LOT_EXPIRY + " WHERE sl_no=?", (sl_no,))
+
+    @locked
+    def receive_lot(self, sl_no, lot_no, qty, exp_date):
+        # Books a delivery in as a new lot; the product's total and next expiry follow.
+        qty = to_int(qty, None)
+        if qty is None or qty <= 0:
+            raise ValueError(f"Invalid quantity {qty!r}")
+        # Values may come from a JSON body as null or a number rather than form text.
+        lot_no = "" if lot_no is None else str(lot_no).strip()
+        exp_date = "" if exp_date is None else str(exp_date).strip()
+        exp_day = exp_day_of(exp_date)
+        if exp_day is None:
+            raise ValueError(f"Invalid expiry date {exp_date!r} (expected DD/MM/YY)")
+        try:
+            self.cursor.execute("UPDATE med SET qty_left = qty_left + ?, version = version + 1 WHERE sl_no=?",
+                                (qty, catalog_key(sl_no)))
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                raise KeyError(f"No product with ID {sl_no}")
+            self.cursor.execute("INSERT INTO lots (sl_no, lot_no, qty, exp_date, exp_day, received_at) "
+                                "VALUES (?,?,?,?,?,?)",
+                                (catalog_key(sl_no), lot_no or None, qty, exp_date, exp_day, now_iso()))
+            lot_id = self.cursor.lastrowid
+            self.cursor.execute("UPDATE med SET " + NEXT_LOT_EXPIRY + " WHERE sl_no=?", (catalog_key(sl_no),))
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
         self.conn.commit()
+        self._reload_cached(catalog_key(sl_no))
+        return lot_id
+
+    @locked
+    def lots_for_name(self, name):
+        # (lot_no, qty, exp_date) for every lot in stock of the named product, soonest first.
+        self.cursor.execute("SELECT l.lot_no, l.qty, l.exp_date FROM lots l JOIN med m ON m.sl_no = l.sl_no "
+                            "WHERE m.name=? AND l.qty > 0 ORDER BY l.exp_day IS NULL, l.exp_day", (name,))
+        return self.cursor.fetchall()
+
+    def _find_conflicts(self, touched):
+        conflicts = []
+        for key, expected in touched:
+            self.cursor.execute("SELECT version FROM med WHERE sl_no=?", (key,))
+            row = self.cursor.fetchone()
+            if row is None or (expected is not None and row[0] != expected):
+                conflicts.append(key)
+        return conflicts
 
+    @locked
     def search_by_symptom(self, symptom):
-        self.cursor.execute("SELECT * FROM med WHERE purpose=?", (symptom,))
+        return self.catalog.with_purpose(symptom)
+
+    def import_medicines(self, path, batch_size=5000):
+        # Streams the file, validates each record and upserts in batches of batch_size
+        # rows, one transaction each. Returns (rows imported, [(line, error), ...]).
+        records = ((line_no or number + 1, record)  # CSV rows start after the header
+                   for number, (line_no, record) in enumerate(read_medicine_file(path), start=1))
+        return self.import_records(records, bulk=os.path.getsize(path) > self.BULK_IMPORT_BYTES,
+                                   batch_size=batch_size)
+
+    def import_records(self, records, bulk=False, batch_size=5000, rebuild_index=True):
+        # records: iterable of (line_no, record dict). bulk suspends the search index
+        # triggers for the duration and rebuilds it once at the end; with rebuild_index
+        # False (one import sent in several calls) that is left to finish_bulk_import.
+        # An imported row is a stock count: its qty_left and exp_date replace the
+        # product's lots with one lot.
+        upsert = ("INSERT INTO med (" + ", ".join(MED_COLUMNS) + ", exp_day) VALUES (?,?,?,?,?,?,?,?,?,?) "
+                  "ON CONFLICT(sl_no) DO UPDATE SET "
+                  + ", ".join(f"{col} = excluded.{col}" for col in MED_COLUMNS[1:] + ("exp_day",))
+                  + ", version = version + 1")
+        imported = 0
+        errors = []
+        batch = []
+        suspend = self.has_search_index and bulk
+        if suspend:
+            self._suspend_search_index()
+        try:
+            for line_no, record in records:
+                if isinstance(record, Exception):
+                    errors.append((line_no, str(record)))
+                    continue
+                try:
+                    batch.append(validate_medicine(record))
+                except (ValueError, AttributeError) as e:
+                    errors.append((line_no, str(e)))
+                    continue
+                if len(batch) >= batch_size:
+                    imported += self._write_batch(upsert, batch)
+                    batch = []
+            if batch:
+                imported += self._write_batch(upsert, batch)
+        finally:
+            if suspend and rebuild_index:
+                self._resume_search_index()
+            if imported:
+                with self.lock:
+                    self._catalog = None  # rebuilt on next use; views fall back to a keyed diff
+        return imported, errors
+
+    @locked
+    def _write_batch(self, sql, rows):
+        # The replacement lots go in with the rows, so a batch commits stock and lots together.
+        keys = [(row[0],) for row in rows if row[0]]
+        received = now_iso()
+        try:
+            self.cursor.executemany("DELETE FROM lots WHERE sl_no=?", keys)
+            self.cursor.execute("SELECT COALESCE(MAX(sl_no), 0) FROM med")
+            last = self.cursor.fetchone()[0]  # rows without an sl_no are allocated above this
+            self.cursor.executemany(sql, rows)
+            self.cursor.executemany(FILL_MISSING_LOTS + " AND m.sl_no = ?", [(received,) + key for key in keys])
+            self.cursor.execute(FILL_MISSING_LOTS + " AND m.sl_no > ?", (received, last))
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return len(rows)
+
+    def export_medicines(self, path):
+        # Streams rows from a private read connection (WAL), so writers are not held up;
+        # same formats as import_medicines.
+        count = 0
+        reader = sqlite3.connect(self.db_path)
+        with reader, open(path, "w", newline="", encoding="utf-8") as f:
+            rows = reader.execute(MED_SELECT + " ORDER BY sl_no")
+            if path.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(MED_COLUMNS)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(MED_COLUMNS, row))) + "\n")
+                    count += 1
+        reader.close()
+        return count
+
+    @locked
+    def search(self, text, limit=50):
+        # Ranked type-ahead search over name, purpose and manufacturer: name prefix
+        # matches first, then substring matches by bm25, then fuzzy (shared trigram) matches.
+        text = text.strip()
+        if not text:
+            return []
+        if not self.has_search_index:
+            pattern = "%" + like_escape(text) + "%"
+            self.cursor.execute(MED_SELECT + " WHERE name LIKE ? ESCAPE '\\' OR purpose LIKE ? ESCAPE '\\' "
+                                "OR mfg LIKE ? ESCAPE '\\' LIMIT ?", (pattern, pattern, pattern, limit))
+            return self.cursor.fetchall()
+        if len(text) < 3:
+            # Trigrams need three characters; shorter input is a name prefix range scan.
+            self.cursor.execute(MED_SELECT + " WHERE name COLLATE NOCASE >= ? AND name COLLATE NOCASE < ? "
+                                "ORDER BY name COLLATE NOCASE LIMIT ?", (text, text + "\U0010ffff", limit))
+            return self.cursor.fetchall()
+        results = self._fts_search('"' + text.replace('"', '""') + '"', text, limit)
+        if len(results) < limit and len(text) > 3:
+            lowered = text.lower()
+            grams = {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+            query = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in grams)
+            seen = {row[0] for row in results}
+            results += [row for row in self._fts_search(query, text, limit)
+                        if row[0] not in seen][:limit - len(results)]
+        return results
+
+    def _fts_search(self, query, text, limit):
+        columns = ", ".join("m." + col for col in MED_COLUMNS)
+        self.cursor.execute(
+            f"SELECT {columns} FROM med_fts JOIN med m ON m.sl_no = med_fts.rowid "
+            "WHERE med_fts MATCH ? "
+            "ORDER BY m.name LIKE ? ESCAPE '\\' DESC, bm25(med_fts, 10.0, 3.0, 1.0) LIMIT ?",
+            (query, like_escape(text) + "%", limit))
         return self.cursor.fetchall()
 
+    @locked
     def get_medicine_by_sl(self, sl_no):
-        self.cursor.execute("SELECT * FROM med WHERE sl_no=?", (sl_no,))
-        return self.cursor.fetchone()
+        return self.catalog.get(sl_no)
+
+    @locked
+    def find_by_name(self, name):
+        return self.catalog.with_name(name)
 
+    @locked
+    def get_medicine_names(self):
+        return self.catalog.names()
+
+    @locked
+    def get_purposes(self):
+        return self.catalog.purposes()
+
+    @locked
+    def catalog_columns(self):
+        # Shared until the next catalog change; treat it as read-only.
+        return self.catalog.columns()
+
+    @locked
+    def expiring_between(self, start, end):
+        # Every lot in stock whose expiry falls in [start, end] (dates), soonest first,
+        # via idx_lots_exp_day. Rows are LOT_SELECT shaped.
+        self.cursor.execute(LOT_SELECT + " WHERE l.exp_day BETWEEN ? AND ? AND l.qty > 0 ORDER BY l.exp_day",
+                            (epoch_day(start), epoch_day(end)))
+        return self.cursor.fetchall()
+
+    @locked
+    def expiring_within(self, days, include_expired=False):
+        today = date.today()
+        start = EPOCH if include_expired else today
+        return self.expiring_between(start, today + timedelta(days=days))
+
+    @locked
     def update_quantity(self, sl_no, new_qty):
-        self.cursor.execute("UPDATE med SET qty_left=? WHERE sl_no=?", (new_qty, sl_no))
+        self.cursor.execute("UPDATE med SET qty_left=?, version = version + 1 WHERE sl_no=?", (new_qty, sl_no))
+        if self.cursor.rowcount:
+            self._reconcile_lots(catalog_key(sl_no), False)
         self.conn.commit()
+        self._reload_cached(sl_no)
+
+    @locked
+    def checkout(self, bill_items, customer="", address=""):
+        # bill_items: iterable of (sl_no, name, quantity, unit_price). Every line is
+        # decremented and the sale is recorded in one transaction; if any line is
+        # short the whole bill is rolled back. Returns the allocated bill number.
+        wanted, lines = self._tally(bill_items)
+        if not wanted:
+            return None
+        try:
+            allocations = self._take_stock(wanted)
+            if allocations is None:
+                self.conn.rollback()
+                raise StockShortage(self._find_shortages(wanted, lines))
+            bill_no = self._record_sale(self._sale_items(wanted, lines), customer, address, allocations)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self._catalog_sold(wanted)
+        return bill_no
+
+    @locked
+    def checkout_many(self, bills):
+        # bills: list of (bill_items, customer, address), e.g. from several terminals.
+        # Each bill runs in its own SAVEPOINT so a short bill rolls back alone, and the
+        # batch commits once. Returns a bill number (or StockShortage, or the
+        # ValueError/TypeError for a malformed bill) per bill.
+        tallies = []
+        for bill_items, _, _ in bills:
+            try:
+                tallies.append(self._tally(bill_items))
+            except (TypeError, ValueError) as e:
+                tallies.append(e)
+        results = []
+        sold = []
+        try:
+            self.cursor.execute("BEGIN")
+            for (_, customer, address), tally in zip(bills, tallies):
+                if isinstance(tally, Exception):
+                    results.append(tally)
+                    continue
+                wanted, lines = tally
+                if not wanted:
+                    results.append(None)
+                    continue
+                self.cursor.execute("SAVEPOINT bill")
+                allocations = self._take_stock(wanted)
+                if allocations is not None:
+                    results.append(self._record_sale(self._sale_items(wanted, lines), customer, address,
+                                                     allocations))
+                    sold.append(wanted)
+                else:
+                    self.cursor.execute("ROLLBACK TO bill")
+                    results.append(StockShortage(self._find_shortages(wanted, lines)))
+                self.cursor.execute("RELEASE bill")
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        for wanted in sold:
+            self._catalog_sold(wanted)
+        return results
+
+    @staticmethod
+    def _tally(bill_items):
+        # Raises ValueError before anything is written if a quantity is not a whole
+        # number of units above zero ("3" from a form is fine; 2.5, -1 and True are not).
+        wanted = {}
+        lines = {}
+        for sl_no, name, qty, price in bill_items:
+            if isinstance(qty, str) and qty.strip().isdigit():
+                qty = int(qty)
+            if not isinstance(qty, int) or isinstance(qty, bool) or qty <= 0:
+                raise ValueError(f"Quantity for {name!r} must be a positive whole number, not {qty!r}.")
+            key = catalog_key(sl_no)
+            wanted[key] = wanted.get(key, 0) + qty
+            lines[key] = (name, float(price))
+        return wanted, lines
+
+    @staticmethod
+    def _sale_items(wanted, lines):
+        return [(sl_no, lines[sl_no][0], qty, lines[sl_no][1]) for sl_no, qty in wanted.items()]
+
+    def _take_stock(self, wanted):
+        # First expiry, first out: each SKU is taken from its unexpired lots in expiry
+        # order, all SKUs in one idx_lots_fefo lookup. Returns [(lot_id, sl_no, qty)],
+        # or None if any line is short; the caller rolls back the partial decrement.
+        keys = list(wanted)
+        self.cursor.execute(
+            "SELECT lot_id, sl_no, qty FROM lots WHERE sl_no IN (" + ",".join("?" * len(keys)) + ") "
+            "AND qty > 0 AND (exp_day IS NULL OR exp_day >= ?) "
+            "ORDER BY sl_no, exp_day IS NULL, exp_day, lot_id", keys + [epoch_day(date.today())])
+        remaining = dict(wanted)
+        allocations = []
+        for lot_id, sl_no, qty in self.cursor.fetchall():
+            take = min(qty, remaining[sl_no])
+            if take > 0:
+                allocations.append((lot_id, sl_no, take))
+                remaining[sl_no] -= take
+        if any(qty > 0 for qty in remaining.values()):
+            return None
+        self.cursor.executemany("UPDATE lots SET qty = qty - ? WHERE lot_id = ? AND qty >= ?",
+                                [(qty, lot_id, qty) for lot_id, _, qty in allocations])
+        if self.cursor.rowcount != len(allocations):
+            return None
+        params = [(qty, sl_no, qty) for sl_no, qty in wanted.items()]
+        self.cursor.executemany(
+            "UPDATE med SET qty_left = qty_left - ?, version = version + 1, " + NEXT_LOT_EXPIRY +
+            " WHERE sl_no = ? AND qty_left >= ?", params)
+        if self.cursor.rowcount != len(params):
+            return None
+        return allocations
+
+    def _catalog_sold(self, wanted):
+        # Re-read rather than patch: a lot running out moves the product's next expiry.
+        for key in wanted:
+            self._reload_cached(key)
+
+    def _record_sale(self, items, customer, address, allocations=()):
+        # Runs inside the checkout transaction. AUTOINCREMENT never reuses a bill number.
+        now = datetime.now()
+        total = sum(qty * price for _, _, qty, price in items)
+        self.cursor.execute(
+            "INSERT INTO sales (created_at, sale_day, customer, address, total) VALUES (?,?,?,?,?)",
+            (now.isoformat(timespec="seconds"), epoch_day(now.date()), customer, address, total))
+        bill_no = self.cursor.lastrowid
+        self.cursor.executemany(
+            "INSERT INTO sale_items (bill_no, sl_no, name, qty, price) VALUES (?,?,?,?,?)",
+            [(bill_no,) + item for item in items])
+        self.cursor.execute(
+            "INSERT INTO daily_sales (sale_day, bills, revenue) VALUES (?, 1, ?) "
+            "ON CONFLICT(sale_day) DO UPDATE SET bills = bills + 1, revenue = revenue + excluded.revenue",
+            (epoch_day(now.date()), total))
+        self.cursor.executemany(
+            "INSERT INTO item_sales (sl_no, name, qty_sold, revenue) VALUES (?,?,?,?) "
+            "ON CONFLICT(sl_no) DO UPDATE SET name = excluded.name, "
+            "qty_sold = qty_sold + excluded.qty_sold, revenue = revenue + excluded.revenue",
+            [(sl_no, name, qty, qty * price) for sl_no, name, qty, price in items])
+        self.cursor.executemany(
+            "INSERT INTO item_velocity (sl_no, rate, updated_day) VALUES (?,?,?) "
+            "ON CONFLICT(sl_no) DO UPDATE SET "
+            "rate = rate * pow(?, excluded.updated_day - updated_day) + excluded.rate, "
+            "updated_day = excluded.updated_day",
+            [(sl_no, qty * (1 - VELOCITY_DECAY), epoch_day(now.date()), VELOCITY_DECAY)
+             for sl_no, _, qty, _ in items])
+        self.cursor.executemany("INSERT INTO sale_lots (bill_no, lot_id, sl_no, qty) VALUES (?,?,?,?)",
+                                [(bill_no,) + allocation for allocation in allocations])
+        return bill_no
+
+    @locked
+    def dashboard_stats(self, top=5):
+        # Inventory figures come from the catalog counters and sales figures from the
+        # aggregate tables, so the cost does not grow with catalog or history size.
+        # Before the catalog is loaded (the dashboard at login) one aggregate query
+        # stands in, leaving the full load to the background prefetch.
+        today = epoch_day(date.today())
+        if self._catalog is None:
+            self.cursor.execute(STOCK_TOTALS_SELECT, (MedicineCatalog.LOW_STOCK_LEVEL, today, today + 30))
+            stock_value, low_stock, expiring = self.cursor.fetchone()
+            low_stock, expiring = int(low_stock), int(expiring)
+        else:
+            catalog = self._catalog
+            stock_value, low_stock, expiring = catalog.stock_value, catalog.low_stock, catalog.expiring_count(30)
+        self.cursor.execute("SELECT bills, revenue FROM daily_sales WHERE sale_day=?", (today,))
+        bills, revenue = self.cursor.fetchone() or (0, 0.0)
+        self.cursor.execute("SELECT sl_no, name, qty_sold, revenue FROM item_sales "
+                            "ORDER BY qty_sold DESC LIMIT ?", (top,))
+        return {
+            "stock_value": stock_value,
+            "low_stock": low_stock,
+            "expiring_30": expiring,
+            "today_bills": bills,
+            "today_revenue": revenue,
+            "top_sellers": self.cursor.fetchall(),
+        }
+
+    @locked
+    def reorder_suggestions(self, limit=-1):
+        # Purchase suggestions, least days of cover first: one REORDER_COLUMNS tuple per
+        # SKU at or below its reorder point, with the order quantity rounded up.
+        self.cursor.execute(REORDER_SELECT + " LIMIT :limit", {
+            "decay": VELOCITY_DECAY, "today": epoch_day(date.today()), "min_velocity": MIN_VELOCITY,
+            "lead": LEAD_TIME_DAYS, "safety": SAFETY_DAYS, "review": REVIEW_DAYS, "limit": limit})
+        return [row[:6] + (math.ceil(row[6]),) for row in self.cursor.fetchall()]
+
+    @locked
+    def get_sale(self, bill_no):
+        # (sales row, [sale_items rows]) or None for an unknown bill number.
+        self.cursor.execute(SALE_SELECT + " WHERE bill_no=?", (bill_no,))
+        sale = self.cursor.fetchone()
+        if sale is None:
+            return None
+        self.cursor.execute("SELECT sl_no, name, qty, price FROM sale_items WHERE bill_no=? ORDER BY rowid",
+                            (bill_no,))
+        return sale, self.cursor.fetchall()
+
+    @locked
+    def sales_between(self, start, end):
+        self.cursor.execute(SALE_SELECT + " WHERE sale_day BETWEEN ? AND ? ORDER BY bill_no",
+                            (epoch_day(start), epoch_day(end)))
+        return self.cursor.fetchall()
+
+    @locked
+    def bills_between(self, start, end):
+        # [(sales row, [sale_items rows])] as get_sale returns them, for every bill dated
+        # in [start, end]. Bill numbers grow with time, so the items come from one
+        # primary-key range scan rather than a query per bill.
+        sales = self.sales_between(start, end)
+        if not sales:
+            return []
+        items = {sale[0]: [] for sale in sales}
+        self.cursor.execute("SELECT bill_no, sl_no, name, qty, price FROM sale_items "
+                            "WHERE bill_no BETWEEN ? AND ? ORDER BY bill_no, rowid", (sales[0][0], sales[-1][0]))
+        for row in self.cursor:
+            lines = items.get(row[0])
+            if lines is not None:
+                lines.append(row[1:])
+        return [(sale, items[sale[0]]) for sale in sales]
+
+    @locked
+    def sales_for_customer(self, customer):
+        self.cursor.execute(SALE_SELECT + " WHERE customer=? COLLATE NOCASE ORDER BY bill_no", (customer,))
+        return self.cursor.fetchall()
+
+    @locked
+    def sales_of_item(self, sl_no):
+        # (bill_no, created_at, qty, price) for every sale that included the SKU.
+        self.cursor.execute(
+            "SELECT s.bill_no, s.created_at, i.qty, i.price FROM sale_items i "
+            "JOIN sales s ON s.bill_no = i.bill_no WHERE i.sl_no=? ORDER BY s.bill_no", (sl_no,))
+        return self.cursor.fetchall()
+
+    def _find_shortages(self, wanted, lines):
+        # Expired lots are still on hand (qty_left) but cannot be sold.
+        shortages = []
+        today = epoch_day(date.today())
+        for sl_no, qty in wanted.items():
+            self.cursor.execute("SELECT COALESCE(SUM(qty), 0) FROM lots WHERE sl_no=? AND qty > 0 "
+                                "AND (exp_day IS NULL OR exp_day >= ?)", (sl_no, today))
+            available = self.cursor.fetchone()[0]
+            if available < qty:
+                shortages.append((sl_no, lines[sl_no][0], qty, available))
+        return shortages
+
+
+class ConcurrentModification(Exception):
+    def __init__(self, sl_nos):
+        # sl_nos: products changed (or deleted) by someone else since they were read
+        self.sl_nos = sl_nos
+        super().__init__("Changed by another user since it was opened: product ID "
+                         + ", ".join(str(sl_no) for sl_no in sl_nos))
+
+
+class StockShortage(Exception):
+    def __init__(self, shortages):
+        # shortages: list of (sl_no, name, requested, available)
+        self.shortages = shortages
+        lines = ", ".join(f"{name} (requested {req}, available {avail})"
+                          for _, name, req, avail in shortages)
+        super().__init__(f"Insufficient stock: {lines}")
+
+
+# ---------------------------
+# Background DB Worker
+# ---------------------------
+class DBWorker:
+    # Runs database calls on one background thread and hands results back to the Tk
+    # thread through a queue drained with after(), so SQLite never blocks the event loop.
+    POLL_MS = 15
+
+    def __init__(self, root, name="db-worker"):
+        self.root = root
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+        self.root.after(self.POLL_MS, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        # on_done(result) / on_error(exception) run on the Tk thread. Errors without an
+        # on_error handler are shown in a dialog.
+        future = Future()
+        self.jobs.put((fn, args, future, on_done, on_error))
+        return future
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            fn, args, future, on_done, on_error = job
+            try:
+                result = fn(*args)
+            except Exception as e:
+                future.set_exception(e)
+                self.results.put((on_error or self._report, e))
+            else:
+                future.set_result(result)
+                if on_done is not None:
+                    self.results.put((on_done, result))
+
+    def _poll(self):
+        # A callback that fails (e.g. it touches a page destroyed by logout) is reported
+        # like any other Tk callback error; it must not stop the queue from draining.
+        try:
+            while True:
+                try:
+                    callback, value = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    callback(value)
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            self.root.after(self.POLL_MS, self._poll)
+
+    def _report(self, error):
+        messagebox.showerror("Database Error", str(error))
+
+
+# ---------------------------
+# Remote Backend
+# ---------------------------
+class RemoteMedicineDB:
+    # Stands in for MedicineDB when the terminal talks to service.py instead of opening
+    # medicine.db itself. Writes, search and reports go to the service; catalog reads
+    # use a local mirror kept current from the service's change journal.
+    SYNC_SECONDS = 2.0
+    IMPORT_BATCH = 5000
+    BULK_IMPORT_BYTES = MedicineDB.BULK_IMPORT_BYTES
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock()
+        self.local = threading.local()  # one keep-alive connection per thread
+        self._catalog = None
+        self.generation = 0  # which server catalog the mirror follows (bulk imports start a new one)
+        self.server_version = 0
+        self.synced_at = 0.0
+
+    def _request(self, method, path, body=None, retry=False):
+        # retry resends once if the connection drops; only for requests that are safe to
+        # repeat (reads, or writes the service deduplicates).
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        data = None if body is None else json.dumps(body)
+        headers = {} if data is None else {"Content-Type": "application/json"}
+        try:
+            conn.request(method, path, data, headers)
+            response = conn.getresponse()
+            payload = json.loads(response.read() or b"null")
+        except (http.client.HTTPException, ConnectionError):
+            conn.close()
+            self.local.conn = None
+            if not retry:
+                raise
+            return self._request(method, path, body)  # the server dropped a kept-alive connection
+        if response.status == 200:
+            return payload
+        error = payload.get("error") if isinstance(payload, dict) else None
+        if error == "stock_shortage":
+            raise StockShortage([tuple(item) for item in payload["shortages"]])
+        if error == "conflict":
+            raise ConcurrentModification(payload["sl_nos"])
+        message = payload.get("message", error) if isinstance(payload, dict) else payload
+        if error == "not_found":
+            raise KeyError(message)
+        if error == "bad_request":
+            raise ValueError(message)
+        raise RuntimeError(f"Service error {response.status}: {message}")
+
+    def _get(self, path, **params):
+        return self._request("GET", path + ("?" + urlencode(params) if params else ""), retry=True)
+
+    # Catalog mirror
+    @property
+    def catalog_loaded(self):
+        return self._catalog is not None and time.monotonic() - self.synced_at < self.SYNC_SECONDS
+
+    def load_catalog(self):
+        self.sync()
+        return self.catalog
+
+    @property
+    def cached_catalog(self):
+        return self._catalog if self.catalog_loaded else None
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            self.sync()
+        return self._catalog
+
+    def sync(self):
+        with self.sync_lock:
+            loaded = self._catalog is not None
+            changes = self._get("/catalog/changes", generation=self.generation if loaded else 0,
+                                since=self.server_version if loaded else 0)
+            with self.lock:
+                if changes["reset"] or not loaded:
+                    self._catalog = MedicineCatalog(tuple(row) for row in changes["rows"])
+                else:
+                    for key in changes["removed"]:
+                        self._catalog.remove(key)
+                    for row in changes["rows"]:
+                        self._catalog.put(tuple(row[:9]), row[9])
+                self.generation = changes["generation"]
+                self.server_version = changes["version"]
+                self.synced_at = time.monotonic()
+
+    def _fresh(self):
+        if not self.catalog_loaded:
+            self.sync()
+        return self._catalog
+
+    def fetch_all_medicines(self):
+        return self._fresh().all()
+
+    def get_medicine_by_sl(self, sl_no):
+        return self._fresh().get(sl_no)
+
+    def find_by_name(self, name):
+        return self._fresh().with_name(name)
+
+    def search_by_symptom(self, symptom):
+        return self._fresh().with_purpose(symptom)
+
+    def get_medicine_names(self):
+        return self._fresh().names()
+
+    def get_purposes(self):
+        return self._fresh().purposes()
+
+    def catalog_columns(self):
+        return self._fresh().columns()
+
+    def get_version(self, sl_no):
+        return self._fresh().row_version(sl_no)
+
+    def get_medicine_with_version(self, sl_no):
+        return self._fresh().get_with_version(sl_no)
+
+    def export_medicines(self, path):
+        # Written from the synced mirror in the same formats as MedicineDB.export_medicines.
+        rows = sorted(self.load_catalog().all(), key=lambda row: catalog_key(row[0]))
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            if path.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(MED_COLUMNS)
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(MED_COLUMNS, row))) + "\n")
+        return len(rows)
+
+    # Service calls
+    def search(self, text, limit=50):
+        return [tuple(row) for row in self._get("/search", q=text, limit=limit)]
+
+    def expiring_between(self, start, end):
+        return [tuple(row) for row in self._get("/expiry", start=start.isoformat(), end=end.isoformat())]
+
+    def expiring_within(self, days, include_expired=False):
+        today = date.today()
+        start = EPOCH if include_expired else today
+        return self.expiring_between(start, today + timedelta(days=days))
+
+    def dashboard_stats(self, top=5):
+        stats = self._get("/stats", top=top)
+        stats["top_sellers"] = [tuple(row) for row in stats["top_sellers"]]
+        return stats
+
+    def reorder_suggestions(self, limit=-1):
+        return [tuple(row) for row in self._get("/reorder", limit=limit)]
+
+    def lots_for_name(self, name):
+        return [tuple(row) for row in self._get("/lots", name=name)]
+
+    def receive_lot(self, sl_no, lot_no, qty, exp_date):
+        lot_id = self._request("POST", "/lots", {"sl_no": sl_no, "lot_no": lot_no, "qty": qty,
+                                                 "exp_date": exp_date})["lot_id"]
+        self.sync()
+        return lot_id
+
+    def get_sale(self, bill_no):
+        result = self._get("/sales", bill_no=bill_no)
+        if result is None:
+            return None
+        sale, items = result
+        return tuple(sale), [tuple(item) for item in items]
+
+    def backup(self, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+        # Taken and rotated on the server, in its own backup directory.
+        return self._request("POST", "/backup")["path"]
+
+    def restore(self, snapshot_path):
+        raise RuntimeError("A shared database is restored on the server: stop service.py and run "
+                           "service.py --restore <snapshot> there.")
+
+    def bills_between(self, start, end):
+        return [(tuple(sale), [tuple(item) for item in items])
+                for sale, items in self._get("/sales/range", start=start.isoformat(), end=end.isoformat())]
+
+    def checkout(self, bill_items, customer="", address=""):
+        # The service answers a repeated idempotency_key with the first result, so a checkout
+        # resent after a dropped connection is not billed twice.
+        bill_no = self._request("POST", "/checkout", {"items": list(bill_items), "customer": customer,
+                                                      "address": address, "idempotency_key": uuid.uuid4().hex},
+                                retry=True)["bill_no"]
+        self.sync()
+        return bill_no
+
+    def insert_medicine(self, data):
+        self._request("POST", "/medicines", {"row": list(data)})
+        self.sync()
+
+    def update_medicine(self, field, new_value, sl_no):
+        self.update_medicines([(sl_no, {field: new_value}, None)])
+
+    def update_medicines(self, updates):
+        updated = self._request("POST", "/medicines/update", {"updates": list(updates)})["updated"]
+        self.sync()
+        return updated
+
+    def delete_medicine(self, sl_no):
+        self._request("POST", "/medicines/delete", {"sl_no": sl_no})
+        self.sync()
+
+    def import_medicines(self, path):
+        # The file is read here and sent in batches; the service validates and upserts.
+        imported = 0
+        errors = []
+        bulk = os.path.getsize(path) > self.BULK_IMPORT_BYTES
+        records = ((line_no or number + 1, record)
+                   for number, (line_no, record) in enumerate(read_medicine_file(path), start=1))
+        try:
+            while True:
+                batch = list(islice(records, self.IMPORT_BATCH))
+                if not batch:
+                    break
+                errors += [(line_no, str(record)) for line_no, record in batch if isinstance(record, Exception)]
+                batch = [item for item in batch if not isinstance(item[1], Exception)]
+                result = self._request("POST", "/medicines/import", {"records": batch, "bulk": bulk})
+                imported += result["imported"]
+                errors += [tuple(error) for error in result["errors"]]
+        finally:
+            if bulk:
+                # Bulk batches leave the search index suspended; rebuild it once for the file.
+                self._request("POST", "/medicines/import/finish", {}, retry=True)
+        self.sync()
+        errors.sort(key=lambda error: error[0])
+        return imported, errors
+
+
+# ---------------------------
+# Billing Model
+# ---------------------------
+class BillLine:
+    def __init__(self, sl_no, name, price, qty):
+        self.sl_no = catalog_key(sl_no)
+        self.name = name
+        self.price = price
+        self.qty = qty
+
+    @property
+    def amount(self):
+        return self.price * self.qty
+
+
+class Bill:
+    # Lines keyed by sl_no with the unit price captured when the item was added and a
+    # running total, so adding, editing or removing a line never re-prices the others.
+    def __init__(self):
+        self.lines = {}
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, sl_no, name, price, qty):
+        # Adding a SKU that is already on the bill increases that line's quantity.
+        line = self.lines.get(catalog_key(sl_no))
+        if line is None:
+            line = self.lines[catalog_key(sl_no)] = BillLine(sl_no, name, price, 0)
+        return self.set_quantity(line.sl_no, line.qty + qty)
+
+    def set_quantity(self, sl_no, qty):
+        line = self.lines[catalog_key(sl_no)]
+        self.total += line.price * (qty - line.qty)
+        line.qty = qty
+        return line
+
+    def remove(self, sl_no):
+        line = self.lines.pop(catalog_key(sl_no), None)
+        if line is not None:
+            self.total -= line.amount
+        if not self.lines:
+            self.total = 0.0  # drop accumulated float error once the bill is empty
+        return line
+
+    def clear(self):
+        self.lines.clear()
+        self.total = 0.0
+
+    def items(self):
+        return [(line.sl_no, line.name, line.qty, line.price) for line in self.lines.values()]
+
+
+def format_bill(sale, items):
+    # Plain-text bill built from the sales ledger rather than from widget contents.
+    bill_no, created_at, customer, address, total = sale
+    text = f"Bill No: {bill_no}\nDate: {created_at}\n"
+    if customer:
+        text += f"Customer: {customer}\n"
+    if address:
+        text += f"Address: {address}\n"
+    text += "Bill Summary\n" + "="*40 + "\n"
+    for _, name, qty, price in items:
+        text += f"{name}: {qty} x PHP {price:.2f} = PHP {qty * price:.2f}\n"
+    text += "="*40 + f"\nTotal: PHP {total:.2f}\n"
+    return text
+
+
+# ---------------------------
+# Bill Rendering
+# ---------------------------
+RECEIPT_WIDTH = 32  # characters per line on a 58 mm thermal roll
+
+
+def format_receipt(sale, items, width=RECEIPT_WIDTH):
+    # Narrow layout: name on its own line, then quantity x price with the amount
+    # right-aligned, so long names wrap instead of pushing the figures off the roll.
+    bill_no, created_at, customer, address, total = sale
+    rule = "-" * width
+    lines = [f"Bill No: {bill_no}".center(width), created_at.replace("T", " ").center(width)]
+    if customer:
+        lines.append(f"Customer: {customer}"[:width])
+    if address:
+        lines.append(f"Address: {address}"[:width])
+    lines.append(rule)
+    for _, name, qty, price in items:
+        for start in range(0, max(len(name), 1), width):
+            lines.append(name[start:start + width])
+        left = f"  {qty} x {price:.2f}"
+        lines.append(left + f"{qty * price:.2f}".rjust(width - len(left)))
+    lines.append(rule)
+    lines.append("TOTAL" + f"PHP {total:.2f}".rjust(width - 5))
+    return "\n".join(lines) + "\n"
+
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def text_to_pdf(text, lines_per_page=60):
+    # Minimal PDF 1.4: A4 pages of monospaced text in the built-in Courier font, so
+    # no PDF library is needed. Characters outside Latin-1 print as '?'.
+    lines = text.splitlines() or [""]
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 792 Td\n" + "".join(f"({pdf_escape(line)}) Tj T*\n" for line in page) + "ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+# format -> (file name suffix, renderer(sale, items) -> bytes)
+BILL_FORMATS = {
+    "txt": (".txt", lambda sale, items: format_bill(sale, items).encode("utf-8")),
+    "receipt": ("_receipt.txt", lambda sale, items: format_receipt(sale, items).encode("utf-8")),
+    "pdf": (".pdf", lambda sale, items: text_to_pdf(format_bill(sale, items))),
+}
+
+
+def write_bill(sale, items, fmt, out_dir="."):
+    # Written to a temporary name and renamed, so a bill file is never seen half-written.
+    suffix, render = BILL_FORMATS[fmt]
+    path = os.path.join(out_dir, f"bill_{sale[0]}{suffix}")
+    with open(path + ".tmp", "wb") as f:
+        f.write(render(sale, items))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def write_bill_files(db, bill_no, formats, out_dir="."):
+    result = db.get_sale(bill_no)
+    if result is None:
+        raise KeyError(f"No bill number {bill_no}.")
+    sale, items = result
+    return [write_bill(sale, items, fmt, out_dir) for fmt in formats]
+
+
+def rerender_bills(db, start, end, formats, out_dir):
+    # Audit export: every bill dated in [start, end], fetched in one pass.
+    count = 0
+    for sale, items in db.bills_between(start, end):
+        for fmt in formats:
+            write_bill(sale, items, fmt, out_dir)
+        count += 1
+    return count
+
+
+# ---------------------------
+# Treeview Helpers
+# ---------------------------
+class TreeviewSync:
+    # Keeps a Treeview in step with the catalog using one iid per sl_no. Only rows
+    # that changed since the last sync are touched. Catalogs larger than page_size
+    # are shown one page at a time so at most page_size rows exist in the widget.
+    def __init__(self, tree, to_values, page_size=1000):
+        self.tree = tree
+        self.to_values = to_values
+        self.page_size = page_size
+        self.page = 0
+        self._catalog = None
+        self._version = None
+        self._paged = False
+        self._shown = {}  # iid -> values currently in the tree
+
+    def sync(self, catalog):
+        paged = len(catalog) > self.page_size
+        if paged:
+            self.page = min(self.page, self.page_count(catalog) - 1)
+            start = self.page * self.page_size
+            self._diff({str(catalog_key(row[0])): row for row in catalog.window(start, self.page_size)})
+        else:
+            changes = None
+            if catalog is self._catalog and not self._paged:
+                changes = catalog.changes_since(self._version)
+            if changes is None:
+                self._diff({str(key): row for key, row in catalog.rows.items()})
+            else:
+                for key in changes:
+                    self._apply(str(key), catalog.get(key))
+        self._catalog = catalog
+        self._version = catalog.version
+        self._paged = paged
+
+    def _diff(self, wanted):
+        stale = [iid for iid in self._shown if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+            for iid in stale:
+                del self._shown[iid]
+        for iid, row in wanted.items():
+            self._apply(iid, row)
+
+    def _apply(self, iid, row):
+        if row is None:
+            if self._shown.pop(iid, None) is not None:
+                self.tree.delete(iid)
+            return
+        values = self.to_values(row)
+        shown = self._shown.get(iid)
+        if shown is None:
+            self.tree.insert("", "end", iid=iid, values=values)
+        elif shown != values:
+            self.tree.item(iid, values=values)
+        self._shown[iid] = values
+
+    def page_count(self, catalog):
+        return max(1, -(-len(catalog) // self.page_size))
+
+    def next_page(self, catalog):
+        if self.page + 1 < self.page_count(catalog):
+            self.page += 1
+
+    def prev_page(self, catalog):
+        if self.page > 0:
+            self.page -= 1
+
+    def status(self, catalog):
+        if len(catalog) <= self.page_size:
+            return f"{len(catalog)} items"
+        start = self.page * self.page_size
+        end = min(start + self.page_size, len(catalog))
+        return f"Items {start + 1}-{end} of {len(catalog)}"
+
+
+class StockViewMixin:
+    # The stock list shared by the stock and billing pages: a TreeviewSync in
+    # self.stock_view, its page label in self.page_label, and self.controller.
+    def on_show(self):
+        self.refresh_stock()
+        self.reload_stock()
+
+    def reload_stock(self):
+        # load_catalog runs on the worker and rescans only if another terminal has written.
+        db = self.controller.parent.medicine_db
+        self.controller.parent.db_worker.submit(db.load_catalog, on_done=self.show_catalog)
+
+    def refresh_stock(self):
+        self.with_catalog(self.show_catalog)
+
+    def with_catalog(self, fn):
+        # Calls fn with the catalog. If it is not loaded, or a service terminal's mirror has
+        # gone stale, it is loaded on the DB worker and fn gets the catalog that came back.
+        db = self.controller.parent.medicine_db
+        catalog = db.cached_catalog
+        if catalog is None:
+            self.page_label.config(text="Loading...")
+            self.controller.parent.db_worker.submit(db.load_catalog, on_done=fn)
+            return
+        fn(catalog)
+
+    def show_catalog(self, catalog, turn_page=None):
+        with catalog.lock:
+            if turn_page is not None:
+                turn_page(catalog)
+            self.stock_view.sync(catalog)
+            self.page_label.config(text=self.stock_view.status(catalog))
+
+    def prev_page(self):
+        self.with_catalog(lambda catalog: self.show_catalog(catalog, self.stock_view.prev_page))
+
+    def next_page(self):
+        self.with_catalog(lambda catalog: self.show_catalog(catalog, self.stock_view.next_page))
+
+
+# ---------------------------
+# Instrumentation
+# ---------------------------
+class CallStats:
+    # Latency histogram with power-of-two millisecond buckets; the last is open-ended.
+    BOUNDS_MS = [0.125 * 2 ** i for i in range(15)]
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+
+    def add(self, ms, rows=None, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if rows is not None:
+            self.rows += rows
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if ms < bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile (never above the slowest call).
+        seen = 0
+        for bound, count in zip(self.BOUNDS_MS + [self.max_ms], self.buckets):
+            seen += count
+            if seen >= fraction * self.calls:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "total_ms": round(self.total_ms, 3),
+                "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+                "p95_ms": round(self.percentile(0.95), 3), "max_ms": round(self.max_ms, 3), "rows": self.rows,
+                "histogram": dict(zip([f"<{bound:g}ms" for bound in self.BOUNDS_MS] + ["slower"], self.buckets))}
+
+
+class InstrumentedCursor:
+    # Stands in for a handler's cursor: times every statement by its SQL text and
+    # forwards everything else to the real cursor.
+    def __init__(self, profiler, cursor):
+        self._profiler = profiler
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        finally:
+            self._profiler.statement(self._cursor.connection, sql, params, (time.perf_counter() - start) * 1000)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._profiler.statement(self._cursor.connection, sql, None, (time.perf_counter() - start) * 1000)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    # Counts the commits that actually end a transaction. (A trace callback would
+    # also see every statement FTS5 runs internally, which costs more than the query.)
+    def __init__(self, profiler, name, conn):
+        self._profiler = profiler
+        self._name = name
+        self._conn = conn
+
+    def commit(self):
+        pending = self._conn.in_transaction
+        self._conn.commit()
+        if pending:
+            self._profiler.count_commit(self._name)
+
+    def execute(self, sql, params=()):
+        return InstrumentedCursor(self._profiler, self._conn.cursor()).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return InstrumentedCursor(self._profiler, self._conn.cursor()).executemany(sql, seq_of_params)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._conn.rollback()
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class Profiler:
+    # Opt-in (MEDICAL_PROFILE=1): install() swaps timed wrappers into the database
+    # handler and page classes, and instrument_db() into a handler's cursor. Nothing
+    # is wrapped until then, so an uninstrumented run pays nothing.
+    SLOW_QUERY_MS = 20
+    SLOW_QUERY_LOG = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.originals = []  # (class, attribute, function) to restore on uninstall
+        self.reset()
+
+    @property
+    def installed(self):
+        return bool(self.originals)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.commits = {}
+            self.slow_queries = deque(maxlen=self.SLOW_QUERY_LOG)
+            self.started_at = datetime.now()
+
+    def record(self, name, ms, rows=None, failed=False):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = CallStats()
+            stats.add(ms, rows, failed)
+
+    def statement(self, conn, sql, params, ms):
+        sql = re.sub(r"\?(\s*,\s*\?)+", "?, ...", " ".join(sql.split()))  # one key per IN-list shape
+        self.record("SQL " + sql, ms)
+        if ms >= self.SLOW_QUERY_MS:
+            plan = ""
+            if params is not None:
+                try:
+                    plan = "; ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+                except sqlite3.Error:
+                    pass
+            with self.lock:
+                self.slow_queries.append({"at": now_iso(), "ms": round(ms, 3), "sql": sql, "plan": plan})
+
+    def wrap(self, name, fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                self.record(name, (time.perf_counter() - start) * 1000, failed=True)
+                raise
+            self.record(name, (time.perf_counter() - start) * 1000,
+                        len(result) if isinstance(result, list) else None)
+            return result
+        return timed
+
+    def instrument_class(self, cls):
+        # Public methods and __init__ (construction cost); properties and
+        # staticmethods are left alone.
+        for attr, value in list(vars(cls).items()):
+            if callable(value) and not isinstance(value, (staticmethod, classmethod)) and (
+                    not attr.startswith("_") or attr == "__init__"):
+                setattr(cls, attr, self.wrap(f"{cls.__name__}.{attr}", value))
+                self.originals.append((cls, attr, value))
+
+    def instrument_db(self, name, db):
+        # Statement timings and commit counts for one handler's connection.
+        if not isinstance(getattr(db, "conn", None), sqlite3.Connection):
+            return  # RemoteMedicineDB: its calls are timed as methods
+        db.cursor = InstrumentedCursor(self, db.cursor)
+        db.conn = InstrumentedConnection(self, name, db.conn)
+
+    def count_commit(self, name):
+        with self.lock:
+            self.commits[name] = self.commits.get(name, 0) + 1
+
+    def install(self):
+        if self.installed:
+            return
+        for cls in (AdminDB, MedicineDB, RemoteMedicineDB, TreeviewSync, MainAppFrame, DashboardPage, StockPage,
+                    BillingPage, SearchPage, ExpiryCheckPage):
+            self.instrument_class(cls)
+
+    def uninstall(self):
+        for cls, attr, value in reversed(self.originals):
+            setattr(cls, attr, value)
+        self.originals = []
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "taken_at": now_iso(),
+                "calls": {name: stats.to_dict() for name, stats in self.stats.items()},
+                "commits": dict(self.commits),
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
+
+
+PROFILER = Profiler()
 
 
 # ---------------------------
 # Main Application Class
 # ---------------------------
 class MedicalManagementApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, service_url=None):
         super().__init__()
         self.title("Medical Management System")
         self.geometry("1024x768")
@@ -85,14 +2419,56 @@ class MedicalManagementApp(tk.Tk):
         self.sidebar_font = ("Segoe UI", 10, "bold")
 
         # Database handlers
-        self.admin_db = AdminDB()
-        self.medicine_db = MedicineDB()
+        # With a service URL this terminal shares one medicine.db through service.py.
+        self.medicine_db = RemoteMedicineDB(service_url) if service_url else MedicineDB()
+        self.db_worker = DBWorker(self)
+        # Opening admin.db may run the credential migration, which hashes every stored
+        # password; open it on the worker and enable login once it is ready.
+        self.admin_db = None
+        self.db_worker.submit(AdminDB, on_done=self.admin_db_ready, on_error=self.admin_db_failed)
+        # Bill files are rendered and written on their own thread, behind no database work.
+        self.bill_spooler = DBWorker(self, name="bill-spooler")
+        self.backup_worker = DBWorker(self, name="backup")
+        self.after(BACKUP_INTERVAL_MS, self.scheduled_backup)
+        if PROFILER.installed:
+            PROFILER.instrument_db("medicine.db", self.medicine_db)
+        self.session = None
         self.current_user_role = None  # 'admin' or 'customer'
 
         # Initially, show the login page.
         self.login_page = LoginPage(self)
         self.login_page.pack(fill="both", expand=True)
 
+    def admin_db_ready(self, admin_db):
+        self.admin_db = admin_db
+        if PROFILER.installed:
+            PROFILER.instrument_db("admin.db", admin_db)
+        self.login_page.enable_login()
+
+    def admin_db_failed(self, error):
+        messagebox.showerror("Database Error", f"Could not open admin.db: {error}")
+
+    def start_session(self, username, role):
+        self.session = Session(username, role)
+        self.current_user_role = role
+        self.show_main_app()
+
+    def end_session(self):
+        self.session = None
+        self.current_user_role = None
+
+    def backup_databases(self):
+        # Runs on the backup worker. A service terminal's medicine.db is snapshotted on
+        # the server (POST /backup).
+        return [self.admin_db.backup(), self.medicine_db.backup()]
+
+    def scheduled_backup(self):
+        # A service terminal only backs up its admin.db; the service snapshots the shared
+        # database itself (service.py --backup-hours) rather than once per terminal.
+        job = self.backup_databases if isinstance(self.medicine_db, MedicineDB) else self.admin_db.backup
+        self.backup_worker.submit(job, on_error=lambda e: messagebox.showerror("Backup Failed", str(e)))
+        self.after(BACKUP_INTERVAL_MS, self.scheduled_backup)
+
     def show_main_app(self):
         # Destroy the login page and create the main app layout.
         self.login_page.destroy()
@@ -127,19 +2503,35 @@ class LoginPage(ttk.Frame):
         self.password_entry = ttk.Entry(form_frame, width=30, show="*")
         self.password_entry.grid(row=2, column=1, padx=5, pady=5)
 
-        login_btn = ttk.Button(form_frame, text="Login", command=self.check_login)
-        login_btn.grid(row=3, column=0, columnspan=2, pady=20)
+        self.login_btn = ttk.Button(form_frame, text="Login", command=self.check_login)
+        self.login_btn.grid(row=3, column=0, columnspan=2, pady=20)
+        # Enabled by the app once admin.db is open.
+        if parent.admin_db is None:
+            self.login_btn.state(["disabled"])
+
+    def enable_login(self):
+        self.login_btn.state(["!disabled"])
 
     def check_login(self):
         username = self.username_entry.get().strip()
         password = self.password_entry.get().strip()
-        result = self.parent.admin_db.check_login(username, password)
-        if result:
-            self.parent.current_user_role = "admin" if username.lower() == "admin" else "customer"
-            self.parent.show_main_app()
+        # Password hashing takes a noticeable fraction of a second; keep it off the Tk thread.
+        self.login_btn.state(["disabled"])
+        self.parent.db_worker.submit(self.parent.admin_db.check_login, username, password,
+                                     on_done=lambda role: self.login_done(username, role),
+                                     on_error=self.login_error)
+
+    def login_done(self, username, role):
+        if role:
+            self.parent.start_session(username, role)
         else:
+            self.login_btn.state(["!disabled"])
             messagebox.showerror("Login Failed", "Invalid username or password.")
 
+    def login_error(self, error):
+        self.login_btn.state(["!disabled"])
+        messagebox.showerror("Login Failed", str(error))
+
 
 # ---------------------------
 # Main App Frame with Sidebar and Content Area
@@ -165,13 +2557,28 @@ class MainAppFrame(ttk.Frame):
         # Build sidebar navigation buttons
         self.build_sidebar()
 
-        # Dictionary of pages for easy switching
+        # Pages are built on first navigation. Only the dashboard is needed at login;
+        # the catalog data the other pages read is prefetched while it is on screen.
+        self.page_classes = {P.__name__: P for P in (DashboardPage, StockPage, BillingPage, SearchPage,
+                                                     ExpiryCheckPage, DiagnosticsPage, BackupPage)
+                             if self.parent.session.can(P.__name__)}
         self.pages = {}
-        for P in (DashboardPage, StockPage, BillingPage, SearchPage, ExpiryCheckPage):
-            page = P(self.content, self)
-            self.pages[P.__name__] = page
-            page.grid(row=0, column=0, sticky="nsew")
         self.show_page("DashboardPage")
+        self.after_idle(self.prefetch)
+
+    def prefetch(self):
+        # Queued behind the dashboard's own queries, so it never delays them.
+        db = self.parent.medicine_db
+        self.parent.db_worker.submit(
+            lambda: (db.load_catalog(), db.get_medicine_names(), db.get_purposes()),
+            on_error=lambda e: None)  # a page that needs the data reports the error itself
+
+    def get_page(self, page_name):
+        page = self.pages.get(page_name)
+        if page is None:
+            page = self.pages[page_name] = self.page_classes[page_name](self.content, self)
+            page.grid(row=0, column=0, sticky="nsew")
+        return page
 
     def build_sidebar(self):
         # Sidebar header
@@ -185,9 +2592,13 @@ class MainAppFrame(ttk.Frame):
             ("Stock", "StockPage"),
             ("Billing", "BillingPage"),
             ("Search", "SearchPage"),
-            ("Expiry Check", "ExpiryCheckPage")
+            ("Expiry Check", "ExpiryCheckPage"),
+            ("Diagnostics", "DiagnosticsPage"),
+            ("Backups", "BackupPage")
         ]
         for text, page in nav_items:
+            if not self.parent.session.can(page):
+                continue
             btn = tk.Button(self.sidebar, text=text, bg=self.parent.sidebar_bg, fg=self.parent.sidebar_fg,
                             activebackground="#34495e", activeforeground=self.parent.sidebar_fg,
                             font=self.parent.sidebar_font, bd=0,
@@ -203,12 +2614,17 @@ class MainAppFrame(ttk.Frame):
         logout_btn.pack(fill="x", padx=20, pady=20)
 
     def show_page(self, page_name):
-        page = self.pages[page_name]
+        if not self.parent.session.can(page_name) or page_name not in self.page_classes:
+            return
+        page = self.get_page(page_name)
         page.tkraise()
+        if hasattr(page, "on_show"):
+            page.on_show()
 
     def logout(self):
         answer = messagebox.askyesno("Logout", "Do you really want to logout?")
         if answer:
+            self.parent.end_session()
             self.destroy()
             # Recreate login page on parent
             self.parent.login_page = LoginPage(self.parent)
@@ -224,14 +2640,80 @@ class DashboardPage(ttk.Frame):
         self.controller = controller
 
         label = ttk.Label(self, text="Welcome to the Dashboard", font=("Segoe UI", 16, "bold"))
-        label.pack(pady=40)
-        # Additional dashboard content can be added here.
+        label.pack(pady=(40, 20))
+
+        kpi_frame = ttk.Frame(self)
+        kpi_frame.pack(pady=10)
+        self.kpi_labels = {}
+        kpis = [
+            ("stock_value", "Total Stock Value"),
+            ("low_stock", f"Low Stock Items (< {MedicineCatalog.LOW_STOCK_LEVEL})"),
+            ("expiring_30", "Expiring in 30 Days"),
+            ("today_revenue", "Today's Revenue"),
+            ("today_bills", "Today's Bills"),
+        ]
+        for i, (key, text) in enumerate(kpis):
+            ttk.Label(kpi_frame, text=f"{text}:").grid(row=i, column=0, padx=10, pady=5, sticky="e")
+            value = ttk.Label(kpi_frame, text="-", font=("Segoe UI", 12, "bold"))
+            value.grid(row=i, column=1, padx=10, pady=5, sticky="w")
+            self.kpi_labels[key] = value
+
+        ttk.Label(self, text="Top Sellers", font=("Segoe UI", 12, "bold")).pack(pady=(20, 5))
+        columns = ("sl_no", "name", "qty_sold", "revenue")
+        self.top_tree = ttk.Treeview(self, columns=columns, show="headings", height=5)
+        for col in columns:
+            self.top_tree.heading(col, text=col.capitalize())
+            self.top_tree.column(col, width=140)
+        self.top_tree.pack(padx=20, pady=5)
+
+        self.reorder_title = ttk.Label(self, text="Reorder Suggestions", font=("Segoe UI", 12, "bold"))
+        self.reorder_title.pack(pady=(20, 5))
+        columns = ("sl_no", "name", "qty_left", "days_of_cover", "order_qty")
+        self.reorder_tree = ttk.Treeview(self, columns=columns, show="headings", height=5)
+        for col in columns:
+            self.reorder_tree.heading(col, text=col.replace("_", " ").capitalize())
+            self.reorder_tree.column(col, width=120)
+        self.reorder_tree.pack(padx=20, pady=5)
+        ttk.Button(self, text="Export Purchase List", command=self.export_purchase_list).pack(pady=5)
+
+    def on_show(self):
+        app = self.controller.parent
+        app.db_worker.submit(app.medicine_db.dashboard_stats, on_done=self.show_stats)
+        app.db_worker.submit(app.medicine_db.reorder_suggestions, on_done=self.show_reorder)
+
+    def show_reorder(self, suggestions):
+        self.reorder_title.config(text=f"Reorder Suggestions ({len(suggestions)})")
+        self.reorder_tree.delete(*self.reorder_tree.get_children())
+        for sl_no, name, qty_left, _, cover, _, order_qty in suggestions[:50]:
+            self.reorder_tree.insert("", "end", values=(sl_no, name, qty_left, f"{cover:.1f}", order_qty))
+
+    def export_purchase_list(self):
+        path = filedialog.asksaveasfilename(title="Export Purchase List", defaultextension=".csv",
+                                            filetypes=[("CSV files", "*.csv")])
+        if not path:
+            return
+        app = self.controller.parent
+        app.db_worker.submit(
+            lambda: write_purchase_list(path, app.medicine_db.reorder_suggestions()),
+            on_done=lambda count: messagebox.showinfo(
+                "Purchase List", f"Wrote {count} suggestion(s) to {os.path.basename(path)}."),
+            on_error=lambda e: messagebox.showerror("Export Failed", str(e)))
+
+    def show_stats(self, stats):
+        self.kpi_labels["stock_value"].config(text=f"PHP {stats['stock_value']:,.2f}")
+        self.kpi_labels["low_stock"].config(text=str(stats["low_stock"]))
+        self.kpi_labels["expiring_30"].config(text=str(stats["expiring_30"]))
+        self.kpi_labels["today_revenue"].config(text=f"PHP {stats['today_revenue']:,.2f}")
+        self.kpi_labels["today_bills"].config(text=str(stats["today_bills"]))
+        self.top_tree.delete(*self.top_tree.get_children())
+        for sl_no, name, qty_sold, revenue in stats["top_sellers"]:
+            self.top_tree.insert("", "end", values=(sl_no, name, qty_sold, f"{revenue:.2f}"))
 
 
 # ---------------------------
 # Stock Maintenance Page
 # ---------------------------
-class StockPage(ttk.Frame):
+class StockPage(StockViewMixin, ttk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
@@ -246,26 +2728,61 @@ class StockPage(ttk.Frame):
             self.tree.heading(col, text=col.capitalize())
             self.tree.column(col, width=90)
         self.tree.pack(padx=20, pady=10)
+        self.stock_view = TreeviewSync(self.tree, tuple)
+
+        page_frame = ttk.Frame(self)
+        page_frame.pack()
+        ttk.Button(page_frame, text="< Prev", command=self.prev_page).grid(row=0, column=0, padx=5)
+        self.page_label = ttk.Label(page_frame, text="")
+        self.page_label.grid(row=0, column=1, padx=10)
+        ttk.Button(page_frame, text="Next >", command=self.next_page).grid(row=0, column=2, padx=5)
 
         btn_frame = ttk.Frame(self)
         btn_frame.pack(pady=10)
-        ttk.Button(btn_frame, text="Refresh", command=self.refresh_stock).grid(row=0, column=0, padx=5)
+        ttk.Button(btn_frame, text="Refresh", command=self.reload_stock).grid(row=0, column=0, padx=5)
         ttk.Button(btn_frame, text="Add", command=self.add_product).grid(row=0, column=1, padx=5)
         ttk.Button(btn_frame, text="Delete", command=self.delete_product).grid(row=0, column=2, padx=5)
         ttk.Button(btn_frame, text="Modify", command=self.modify_product).grid(row=0, column=3, padx=5)
-
-        self.refresh_stock()
-
-    def refresh_stock(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        medicines = self.controller.parent.medicine_db.fetch_all_medicines()
-        for med in medicines:
-            self.tree.insert("", "end", values=med)
+        ttk.Button(btn_frame, text="Bulk Edit", command=self.bulk_edit).grid(row=0, column=4, padx=5)
+        ttk.Button(btn_frame, text="Receive Lot", command=self.receive_lot).grid(row=0, column=5, padx=5)
+        ttk.Button(btn_frame, text="Import", command=self.import_products).grid(row=0, column=6, padx=5)
+        ttk.Button(btn_frame, text="Export", command=self.export_products).grid(row=0, column=7, padx=5)
 
     def add_product(self):
         AddProductWindow(self.controller.parent)
 
+    FILE_TYPES = [("CSV files", "*.csv"), ("JSON Lines files", "*.jsonl *.json")]
+
+    def import_products(self):
+        path = filedialog.askopenfilename(title="Import Products", filetypes=self.FILE_TYPES)
+        if not path:
+            return
+        self.page_label.config(text="Importing...")
+        self.controller.parent.db_worker.submit(
+            self.controller.parent.medicine_db.import_medicines, path, on_done=self.import_finished,
+            on_error=lambda e: messagebox.showerror("Import Failed", str(e)))
+
+    def import_finished(self, result):
+        imported, errors = result
+        message = f"Imported {imported} product(s)."
+        if errors:
+            shown = "\n".join(f"Line {line}: {error}" for line, error in errors[:10])
+            more = f"\n... and {len(errors) - 10} more" if len(errors) > 10 else ""
+            message += f"\n{len(errors)} row(s) skipped:\n{shown}{more}"
+        messagebox.showinfo("Import", message)
+        self.refresh_stock()
+
+    def export_products(self):
+        path = filedialog.asksaveasfilename(title="Export Products", defaultextension=".csv",
+                                            filetypes=self.FILE_TYPES)
+        if not path:
+            return
+        self.controller.parent.db_worker.submit(
+            self.controller.parent.medicine_db.export_medicines, path,
+            on_done=lambda count: messagebox.showinfo(
+                "Export", f"Exported {count} product(s) to {os.path.basename(path)}."),
+            on_error=lambda e: messagebox.showerror("Export Failed", str(e)))
+
     def delete_product(self):
         selected = self.tree.focus()
         if not selected:
@@ -273,8 +2790,8 @@ class StockPage(ttk.Frame):
             return
         values = self.tree.item(selected, "values")
         if messagebox.askyesno("Confirm", f"Delete product '{values[1]}'?"):
-            self.controller.parent.medicine_db.delete_medicine(values[0])
-            self.refresh_stock()
+            self.controller.parent.db_worker.submit(self.controller.parent.medicine_db.delete_medicine, values[0],
+                                                    on_done=lambda _: self.refresh_stock())
 
     def modify_product(self):
         selected = self.tree.focus()
@@ -284,15 +2801,30 @@ class StockPage(ttk.Frame):
         values = self.tree.item(selected, "values")
         ModifyProductWindow(self.controller.parent, values)
 
+    def receive_lot(self):
+        selected = self.tree.focus()
+        if not selected:
+            messagebox.showwarning("Receive Lot", "Select the product the delivery is for.")
+            return
+        ReceiveLotWindow(self.controller.parent, self.tree.item(selected, "values"))
+
+    def bulk_edit(self):
+        selected = self.tree.selection()
+        if not selected:
+            messagebox.showwarning("Bulk Edit", "Select one or more products.")
+            return
+        BulkEditWindow(self.controller.parent, [self.tree.item(iid, "values")[0] for iid in selected])
+
 
 # ---------------------------
 # Billing Page
 # ---------------------------
-class BillingPage(ttk.Frame):
+class BillingPage(StockViewMixin, ttk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        self.bill_items = []  # list of tuples (sl_no, name, quantity)
+        self.bill = Bill()
+        self.checkout_pending = False
 
         title = ttk.Label(self, text="Billing System", font=("Segoe UI", 16, "bold"))
         title.pack(pady=10)
@@ -314,81 +2846,186 @@ class BillingPage(ttk.Frame):
             self.med_tree.heading(col, text=col.capitalize())
             self.med_tree.column(col, width=100)
         self.med_tree.grid(row=0, column=0, columnspan=4, padx=5, pady=5)
-        ttk.Button(med_frame, text="Refresh Stock", command=self.refresh_stock).grid(row=1, column=0, padx=5)
+        self.stock_view = TreeviewSync(self.med_tree, lambda med: (med[0], med[1], med[3], med[4], med[7]))
+        ttk.Button(med_frame, text="Refresh Stock", command=self.reload_stock).grid(row=1, column=0, padx=5)
         ttk.Button(med_frame, text="Add to Bill", command=self.add_to_bill).grid(row=1, column=1, padx=5)
         ttk.Label(med_frame, text="Quantity:").grid(row=1, column=2, padx=5)
         self.entry_qty = ttk.Entry(med_frame, width=10)
         self.entry_qty.grid(row=1, column=3, padx=5)
-        
+        ttk.Button(med_frame, text="Update Qty", command=self.update_bill_quantity).grid(row=2, column=1, padx=5, pady=5)
+        ttk.Button(med_frame, text="Remove from Bill", command=self.remove_from_bill).grid(row=2, column=2, padx=5, pady=5)
+        ttk.Button(med_frame, text="< Prev", command=self.prev_page).grid(row=3, column=0, padx=5, pady=5)
+        self.page_label = ttk.Label(med_frame, text="")
+        self.page_label.grid(row=3, column=1, columnspan=2, padx=5, pady=5)
+        ttk.Button(med_frame, text="Next >", command=self.next_page).grid(row=3, column=3, padx=5, pady=5)
+
         self.txt_bill = tk.Text(self, width=80, height=10)
         self.txt_bill.pack(pady=10)
+        self.generate_bill_summary()
         btn_frame = ttk.Frame(self)
         btn_frame.pack(pady=10)
         ttk.Button(btn_frame, text="Print & Save Bill", command=self.print_and_save_bill).grid(row=0, column=0, padx=5)
         ttk.Button(btn_frame, text="Reset Bill", command=self.reset_bill).grid(row=0, column=1, padx=5)
-
-        self.refresh_stock()
-
-    def refresh_stock(self):
-        for item in self.med_tree.get_children():
-            self.med_tree.delete(item)
-        medicines = self.controller.parent.medicine_db.fetch_all_medicines()
-        for med in medicines:
-            self.med_tree.insert("", "end", values=(med[0], med[1], med[3], med[4], med[7]))
-
-    def add_to_bill(self):
+        ttk.Label(btn_frame, text="Bill No:").grid(row=0, column=2, padx=5)
+        self.entry_reprint = ttk.Entry(btn_frame, width=10)
+        self.entry_reprint.grid(row=0, column=3, padx=5)
+        ttk.Button(btn_frame, text="Reprint", command=self.reprint_bill).grid(row=0, column=4, padx=5)
+        ttk.Label(btn_frame, text="Format:").grid(row=0, column=5, padx=5)
+        self.format_box = ttk.Combobox(btn_frame, values=list(BILL_FORMATS), state="readonly", width=8)
+        self.format_box.set("txt")
+        self.format_box.grid(row=0, column=6, padx=5)
+        ttk.Button(btn_frame, text="Re-render Bills", command=self.rerender_bills).grid(row=0, column=7, padx=5)
+        self.status_label = ttk.Label(self, text="")
+        self.status_label.pack()
+
+    def selected_medicine(self):
+        if self.checkout_pending:
+            messagebox.showwarning("Bill", "The bill is being saved.")
+            return None
         selected = self.med_tree.focus()
         if not selected:
             messagebox.showwarning("Select", "Select a medicine.")
-            return
+            return None
+        return self.med_tree.item(selected, "values")
+
+    def entered_quantity(self):
         qty = self.entry_qty.get().strip()
         if not qty.isdigit() or int(qty) <= 0:
             messagebox.showwarning("Quantity", "Enter a valid quantity.")
+            return None
+        return int(qty)
+
+    def add_to_bill(self):
+        values = self.selected_medicine()
+        if values is None:
+            return
+        qty = self.entered_quantity()
+        if qty is None:
             return
-        values = self.med_tree.item(selected, "values")
-        self.bill_items.append((values[0], values[1], int(qty)))
+        line = self.bill.add(values[0], values[1], float(values[3]), qty)
         self.entry_qty.delete(0, tk.END)
-        self.generate_bill_summary()
+        self.render_line(line)
+
+    def update_bill_quantity(self):
+        values = self.selected_medicine()
+        if values is None:
+            return
+        if catalog_key(values[0]) not in self.bill.lines:
+            messagebox.showwarning("Bill", f"'{values[1]}' is not on the bill.")
+            return
+        qty = self.entered_quantity()
+        if qty is None:
+            return
+        self.entry_qty.delete(0, tk.END)
+        self.render_line(self.bill.set_quantity(values[0], qty))
+
+    def remove_from_bill(self):
+        values = self.selected_medicine()
+        if values is None:
+            return
+        line = self.bill.remove(values[0])
+        if line is not None:
+            ranges = self.txt_bill.tag_ranges(f"line_{line.sl_no}")
+            if ranges:
+                self.txt_bill.delete(ranges[0], ranges[1])
+            self.render_total()
 
     def generate_bill_summary(self):
+        # Full render, used when the bill is (re)started; edits go through render_line.
         self.txt_bill.delete("1.0", tk.END)
-        total = 0.0
-        summary = "Bill Summary\n" + "="*40 + "\n"
-        for sl_no, name, qty in self.bill_items:
-            med = self.controller.parent.medicine_db.get_medicine_by_sl(sl_no)
-            if med:
-                price = float(med[4])
-                cost = price * qty
-                total += cost
-                summary += f"{name}: {qty} x PHP {price:.2f} = PHP {cost:.2f}\n"
-        summary += "="*40 + f"\nTotal: PHP {total:.2f}\n"
-        self.txt_bill.insert(tk.END, summary)
+        self.txt_bill.insert(tk.END, "Bill Summary\n" + "="*40 + "\n")
+        self.txt_bill.insert(tk.END, "\n", "footer")
+        for line in self.bill.lines.values():
+            self.render_line(line, update_total=False)
+        self.render_total()
+
+    def render_line(self, line, update_total=True):
+        # Each line owns a text tag, so only that line is rewritten or appended.
+        tag = f"line_{line.sl_no}"
+        text = f"{line.name}: {line.qty} x PHP {line.price:.2f} = PHP {line.amount:.2f}\n"
+        ranges = self.txt_bill.tag_ranges(tag)
+        if ranges:
+            self.txt_bill.delete(ranges[0], ranges[1])
+            self.txt_bill.insert(ranges[0], text, tag)
+        else:
+            self.txt_bill.insert(self.txt_bill.tag_ranges("footer")[0], text, tag)
+        if update_total:
+            self.render_total()
+
+    def render_total(self):
+        start, end = self.txt_bill.tag_ranges("footer")
+        self.txt_bill.delete(start, end)
+        self.txt_bill.insert(start, "="*40 + f"\nTotal: PHP {self.bill.total:.2f}\n", "footer")
 
     def reset_bill(self):
-        self.bill_items.clear()
-        self.txt_bill.delete("1.0", tk.END)
+        if self.checkout_pending:
+            return
+        self.bill.clear()
+        self.generate_bill_summary()
 
     def print_and_save_bill(self):
-        content = self.txt_bill.get("1.0", tk.END)
-        bill_no = random.randint(100, 999)
-        filename = f"bill_{bill_no}.txt"
-        with open(filename, "w") as f:
-            f.write(content)
-        messagebox.showinfo("Bill Saved", f"Bill saved as {filename}.")
-        # Update stock quantities
-        for sl_no, _, qty in self.bill_items:
-            med = self.controller.parent.medicine_db.get_medicine_by_sl(sl_no)
-            if med:
-                new_qty = max(0, int(med[3]) - qty)
-                self.controller.parent.medicine_db.update_quantity(sl_no, new_qty)
+        if not self.bill:
+            messagebox.showwarning("Bill", "Add items to the bill first.")
+            return
+        if self.checkout_pending:
+            return
+        # Update stock quantities first so a short line aborts the whole sale. The bill
+        # is locked against edits until the worker reports back.
+        self.checkout_pending = True
+        self.controller.parent.db_worker.submit(
+            self.controller.parent.medicine_db.checkout, self.bill.items(),
+            self.entry_name.get().strip(), self.entry_address.get().strip(),
+            on_done=self.checkout_finished, on_error=self.checkout_failed)
+
+    def checkout_finished(self, bill_no):
+        # The sale is committed; the file is left to the spooler so the next sale can start.
+        self.checkout_pending = False
         self.reset_bill()
         self.refresh_stock()
+        self.spool_bill(bill_no, "Bill {} saved as {}.")
+
+    def checkout_failed(self, error):
+        self.checkout_pending = False
+        if isinstance(error, StockShortage):
+            details = "\n".join(f"{name}: requested {req}, available {avail}"
+                                for _, name, req, avail in error.shortages)
+            messagebox.showerror("Insufficient Stock", f"Bill not saved.\n{details}")
+        else:
+            messagebox.showerror("Bill Not Saved", str(error))
+        self.refresh_stock()
+
+    def spool_bill(self, bill_no, message):
+        app = self.controller.parent
+        self.status_label.config(text=f"Writing bill {bill_no}...")
+        app.bill_spooler.submit(
+            write_bill_files, app.medicine_db, bill_no, (self.format_box.get(),),
+            on_done=lambda paths: self.status_label.config(text=message.format(bill_no, ", ".join(paths))),
+            on_error=lambda e: self.spool_failed(bill_no, e))
+
+    def spool_failed(self, bill_no, error):
+        self.status_label.config(text="")
+        if isinstance(error, KeyError):
+            messagebox.showwarning("Reprint", "Enter an existing bill number.")
+        else:
+            messagebox.showerror("Bill File Not Written", f"Bill {bill_no}: {error}")
+
+    def reprint_bill(self):
+        bill_no = self.entry_reprint.get().strip()
+        if not bill_no.isdigit():
+            messagebox.showwarning("Reprint", "Enter an existing bill number.")
+            return
+        self.spool_bill(int(bill_no), "Bill {} reprinted as {}.")
+
+    def rerender_bills(self):
+        RerenderBillsWindow(self.controller.parent, self.format_box.get())
 
 
 # ---------------------------
 # Search Page
 # ---------------------------
 class SearchPage(ttk.Frame):
+    SEARCH_DELAY_MS = 150
+
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
@@ -399,20 +3036,56 @@ class SearchPage(ttk.Frame):
         search_frame = ttk.Frame(self)
         search_frame.pack(pady=10)
         ttk.Label(search_frame, text="Symptom/Purpose:").grid(row=0, column=0, padx=5, pady=5)
-        self.symptom_box = ttk.Combobox(search_frame, values=self.get_symptom_list(), state="readonly", width=30)
+        self.symptom_box = ttk.Combobox(search_frame, values=[], state="readonly", width=30)
         self.symptom_box.grid(row=0, column=1, padx=5, pady=5)
         ttk.Button(search_frame, text="Search", command=self.search_medicines).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Label(search_frame, text="Name/Purpose/MFG:").grid(row=1, column=0, padx=5, pady=5)
+        self.query_entry = ttk.Entry(search_frame, width=33)
+        self.query_entry.grid(row=1, column=1, padx=5, pady=5)
+        self.query_entry.bind("<KeyRelease>", self.schedule_live_search)
+        self._search_job = None
+        self._search_seq = 0
 
         self.results_text = tk.Text(self, width=80, height=10)
         self.results_text.pack(pady=10)
 
+    def on_show(self):
+        self.controller.parent.db_worker.submit(
+            self.get_symptom_list, on_done=lambda values: self.symptom_box.config(values=values))
+
     def get_symptom_list(self):
-        meds = self.controller.parent.medicine_db.fetch_all_medicines()
-        return sorted(set(med[5] for med in meds))
+        return self.controller.parent.medicine_db.get_purposes()
+
+    def schedule_live_search(self, event=None):
+        # Debounce: only search once typing pauses for SEARCH_DELAY_MS.
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(self.SEARCH_DELAY_MS, self.live_search)
+
+    def live_search(self):
+        self._search_job = None
+        text = self.query_entry.get()
+        if not text.strip():
+            self._search_seq += 1  # drop any search still in flight
+            self.results_text.delete("1.0", tk.END)
+            return
+        self.run_search(self.controller.parent.medicine_db.search, text)
 
     def search_medicines(self):
         symptom = self.symptom_box.get()
-        results = self.controller.parent.medicine_db.search_by_symptom(symptom)
+        self.run_search(self.controller.parent.medicine_db.search_by_symptom, symptom)
+
+    def run_search(self, search, text):
+        # Searches run on the DB worker; results from a superseded search are discarded.
+        self._search_seq += 1
+        seq = self._search_seq
+
+        def deliver(results):
+            if seq == self._search_seq:
+                self.show_results(results)
+        self.controller.parent.db_worker.submit(search, text, on_done=deliver)
+
+    def show_results(self, results):
         self.results_text.delete("1.0", tk.END)
         if results:
             for med in results:
@@ -426,6 +3099,8 @@ class SearchPage(ttk.Frame):
 # Expiry Check Page
 # ---------------------------
 class ExpiryCheckPage(ttk.Frame):
+    REPORT_CHUNK = 200
+
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
@@ -439,39 +3114,285 @@ class ExpiryCheckPage(ttk.Frame):
         form_frame = ttk.Frame(self)
         form_frame.pack(pady=10)
         ttk.Label(form_frame, text="Medicine:").grid(row=0, column=0, padx=5, pady=5)
-        self.med_box = ttk.Combobox(form_frame, values=self.get_medicine_names(), state="readonly", width=30)
+        self.med_box = ttk.Combobox(form_frame, values=[], state="readonly", width=30)
         self.med_box.grid(row=0, column=1, padx=5, pady=5)
         ttk.Button(form_frame, text="Check", command=self.check_expiry).grid(row=0, column=2, padx=5, pady=5)
 
         self.result_label = ttk.Label(self, text="", foreground="red", font=("Segoe UI", 12, "bold"))
         self.result_label.pack(pady=10)
 
+        report_frame = ttk.Frame(self)
+        report_frame.pack(pady=10)
+        ttk.Label(report_frame, text="Expiring within (days):").grid(row=0, column=0, padx=5, pady=5)
+        self.entry_days = ttk.Entry(report_frame, width=10)
+        self.entry_days.insert(0, "30")
+        self.entry_days.grid(row=0, column=1, padx=5, pady=5)
+        self.include_expired = tk.BooleanVar(value=True)
+        ttk.Checkbutton(report_frame, text="Include expired", variable=self.include_expired).grid(
+            row=0, column=2, padx=5, pady=5)
+        ttk.Button(report_frame, text="Report", command=self.expiry_report).grid(row=0, column=3, padx=5, pady=5)
+
+        columns = ("sl_no", "name", "lot", "exp_date", "qty", "rack")
+        self.report_tree = ttk.Treeview(self, columns=columns, show="headings", height=10)
+        for col in columns:
+            self.report_tree.heading(col, text=col.capitalize())
+            self.report_tree.column(col, width=120)
+        self.report_tree.pack(padx=20, pady=10)
+        self._report_seq = 0
+
+    def on_show(self):
+        self.controller.parent.db_worker.submit(
+            self.get_medicine_names, on_done=lambda values: self.med_box.config(values=values))
+
     def get_medicine_names(self):
-        meds = self.controller.parent.medicine_db.fetch_all_medicines()
-        return [med[1] for med in meds]
+        return self.controller.parent.medicine_db.get_medicine_names()
 
     def check_expiry(self):
         med_name = self.med_box.get()
-        meds = self.controller.parent.medicine_db.fetch_all_medicines()
-        for med in meds:
-            if med[1] == med_name:
-                try:
-                    exp_str = med[6]  # Expected format "DD/MM/YY"
-                    exp_date = datetime.strptime(exp_str, "%d/%m/%y").date()
-                    today = date.today()
-                    if today > exp_date:
-                        self.result_label.config(text=f"Medicine '{med_name}' expired on {exp_str}!")
-                    else:
-                        self.result_label.config(text=f"Medicine '{med_name}' is valid (expires on {exp_str}).")
-                except Exception as e:
-                    self.result_label.config(text="Date format error.")
-                break
+        if not med_name:
+            return
+        self.controller.parent.db_worker.submit(
+            self.controller.parent.medicine_db.lots_for_name, med_name,
+            on_done=lambda lots: self.show_lots(med_name, lots))
+
+    def show_lots(self, med_name, lots):
+        # lots: (lot_no, qty, exp_date) in stock, soonest expiry first.
+        if not lots:
+            self.result_label.config(text=f"No stock of '{med_name}' on hand.")
+            return
+        expiries = [parse_exp_date(exp_str) for _, _, exp_str in lots]
+        if None in expiries:
+            self.result_label.config(text="Date format error.")
+            return
+        expired = [lot for lot, exp in zip(lots, expiries) if date.today() > exp]
+        if expired:
+            qty = sum(lot[1] for lot in expired)
+            self.result_label.config(text=f"{len(expired)} of {len(lots)} lot(s) of '{med_name}' expired "
+                                          f"({qty} unit(s), earliest {expired[0][2]})!")
+        else:
+            self.result_label.config(text=f"Medicine '{med_name}' is valid "
+                                          f"({len(lots)} lot(s), next expires on {lots[0][2]}).")
+
+    def expiry_report(self):
+        days = self.entry_days.get().strip()
+        if not days.isdigit():
+            messagebox.showwarning("Days", "Enter a valid number of days.")
+            return
+        self.result_label.config(text="Searching...")
+        self._report_seq += 1
+        seq = self._report_seq
+        self.controller.parent.db_worker.submit(
+            self.controller.parent.medicine_db.expiring_within, int(days), self.include_expired.get(),
+            on_done=lambda rows: self.show_report(rows, days, seq))
+
+    def show_report(self, rows, days, seq):
+        if seq != self._report_seq:
+            return
+        self.report_tree.delete(*self.report_tree.get_children())
+        if not rows:
+            self.result_label.config(text=f"Nothing expires within {days} days.")
+        else:
+            self.result_label.config(text=f"{len(rows)} lot(s) expire within {days} days.")
+            self.insert_report_rows(rows, 0, seq)
+
+    def insert_report_rows(self, rows, start, seq):
+        # Fill the tree a chunk per event-loop turn so a long report never stalls input.
+        if seq != self._report_seq:
+            return
+        for lot in rows[start:start + self.REPORT_CHUNK]:
+            self.report_tree.insert("", "end", values=(lot[0], lot[1], lot[9] or "-", lot[6], lot[3], lot[7]))
+        if start + self.REPORT_CHUNK < len(rows):
+            self.after(1, self.insert_report_rows, rows, start + self.REPORT_CHUNK, seq)
+
+
+class DiagnosticsPage(ttk.Frame):
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+
+        title = ttk.Label(self, text="Diagnostics", font=("Segoe UI", 16, "bold"))
+        title.pack(pady=10)
+
+        self.status_label = ttk.Label(self, text="")
+        self.status_label.pack(pady=5)
+
+        btn_frame = ttk.Frame(self)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="Refresh", command=self.refresh).grid(row=0, column=0, padx=5)
+        ttk.Button(btn_frame, text="Reset", command=self.reset).grid(row=0, column=1, padx=5)
+        ttk.Button(btn_frame, text="Export JSON", command=self.export).grid(row=0, column=2, padx=5)
+
+        columns = ("name", "calls", "total_ms", "mean_ms", "p95_ms", "max_ms", "rows")
+        self.stats_tree = ttk.Treeview(self, columns=columns, show="headings", height=12)
+        for col in columns:
+            self.stats_tree.heading(col, text=col.replace("_", " ").capitalize())
+            self.stats_tree.column(col, width=420 if col == "name" else 80, anchor="w" if col == "name" else "e")
+        self.stats_tree.pack(fill="both", expand=True, padx=20, pady=5)
+
+        ttk.Label(self, text="Slow queries", font=("Segoe UI", 12, "bold")).pack(pady=(10, 0))
+        columns = ("at", "ms", "sql", "plan")
+        self.slow_tree = ttk.Treeview(self, columns=columns, show="headings", height=6)
+        for col in columns:
+            self.slow_tree.heading(col, text=col.capitalize())
+            self.slow_tree.column(col, width=320 if col in ("sql", "plan") else 120)
+        self.slow_tree.pack(fill="both", expand=True, padx=20, pady=5)
+
+        self.refresh()
+
+    def on_show(self):
+        self.refresh()
+
+    def refresh(self):
+        if not PROFILER.installed:
+            self.status_label.config(text="Profiling is off. Start the app with MEDICAL_PROFILE=1 to collect timings.")
+            return
+        snapshot = PROFILER.snapshot()
+        commits = ", ".join(f"{name}: {count}" for name, count in sorted(snapshot["commits"].items())) or "none"
+        self.status_label.config(text=f"Collecting since {snapshot['started_at']}  |  commits: {commits}")
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        calls = sorted(snapshot["calls"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        for name, stats in calls:
+            self.stats_tree.insert("", "end", values=(name, stats["calls"], stats["total_ms"], stats["mean_ms"],
+                                                      stats["p95_ms"], stats["max_ms"], stats["rows"]))
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        for query in reversed(snapshot["slow_queries"]):
+            self.slow_tree.insert("", "end", values=(query["at"], query["ms"], query["sql"], query["plan"]))
+
+    def reset(self):
+        PROFILER.reset()
+        self.refresh()
+
+    def export(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        if not path:
+            return
+        try:
+            PROFILER.export(path)
+        except OSError as e:
+            messagebox.showerror("Export", str(e))
+            return
+        messagebox.showinfo("Export", f"Profile written to {path}")
+
+
+class BackupPage(ttk.Frame):
+    def __init__(self, parent, controller):
+        super().__init__(parent)
+        self.controller = controller
+
+        title = ttk.Label(self, text="Backups", font=("Segoe UI", 16, "bold"))
+        title.pack(pady=10)
+        ttk.Label(self, text=f"Online snapshots every {BACKUP_INTERVAL_MS // 3_600_000} hours in "
+                             f"'{BACKUP_DIR}', the newest {BACKUP_KEEP} kept per database.").pack(pady=5)
+
+        columns = ("snapshot", "database", "size", "taken")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=12)
+        for col in columns:
+            self.tree.heading(col, text=col.capitalize())
+            self.tree.column(col, width=260 if col == "snapshot" else 140)
+        self.tree.pack(padx=20, pady=10)
+
+        btn_frame = ttk.Frame(self)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="Back Up Now", command=self.backup_now).grid(row=0, column=0, padx=5)
+        ttk.Button(btn_frame, text="Verify", command=self.verify).grid(row=0, column=1, padx=5)
+        ttk.Button(btn_frame, text="Restore", command=self.restore).grid(row=0, column=2, padx=5)
+        ttk.Button(btn_frame, text="Refresh", command=self.refresh).grid(row=0, column=3, padx=5)
+        self.status_label = ttk.Label(self, text="")
+        self.status_label.pack(pady=5)
+
+    def on_show(self):
+        self.refresh()
+
+    def databases(self):
+        # name -> handler, for the databases whose files are on this machine.
+        app = self.controller.parent
+        dbs = {"admin.db": app.admin_db}
+        if isinstance(app.medicine_db, MedicineDB):
+            dbs["medicine.db"] = app.medicine_db
+        return dbs
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        for name, db in self.databases().items():
+            for path in list_snapshots(db.db_path):
+                taken = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(sep=" ", timespec="seconds")
+                self.tree.insert("", "end", iid=path, values=(os.path.basename(path), name,
+                                                              f"{os.path.getsize(path) / 2**20:.1f} MiB", taken))
+
+    def selected(self, action):
+        selected = self.tree.focus()
+        if not selected:
+            messagebox.showwarning(action, "Select a snapshot.")
+            return None
+        return selected, self.tree.item(selected, "values")[1]
+
+    def backup_now(self):
+        app = self.controller.parent
+        self.status_label.config(text="Backing up...")
+        app.backup_worker.submit(
+            app.backup_databases,
+            on_done=lambda paths: (self.status_label.config(text="Saved " + ", ".join(paths)), self.refresh()),
+            on_error=lambda e: (self.status_label.config(text=""), messagebox.showerror("Backup Failed", str(e))))
+
+    def verify(self):
+        selected = self.selected("Verify")
+        if selected is None:
+            return
+        path = selected[0]
+        self.status_label.config(text=f"Checking {os.path.basename(path)}...")
+        self.controller.parent.backup_worker.submit(
+            check_integrity, path,
+            on_done=lambda problems: self.status_label.config(
+                text=f"{os.path.basename(path)}: " + ("integrity check passed" if not problems
+                                                      else f"{len(problems)} problem(s): {problems[0]}")))
+
+    def restore(self):
+        selected = self.selected("Restore")
+        if selected is None:
+            return
+        path, name = selected
+        if not messagebox.askyesno("Restore", f"Replace {name} with {os.path.basename(path)}?\n"
+                                              "Changes made since the snapshot are lost."):
+            return
+        # On the DB worker, so the restore waits for (and blocks) other database calls.
+        db = self.databases()[name]
+        self.controller.parent.db_worker.submit(
+            db.restore, path,
+            on_done=lambda _: messagebox.showinfo("Restore", f"{name} restored from {os.path.basename(path)}."),
+            on_error=lambda e: messagebox.showerror("Restore Failed", str(e)))
 
 
 # ---------------------------
 # Auxiliary Windows for Stock Management
 # ---------------------------
-class AddProductWindow(tk.Toplevel):
+class FormWindow(tk.Toplevel):
+    # A dialog whose save runs on the DB worker. The button stays disabled while the save
+    # is in flight; a rejected value leaves the form open to be corrected.
+    def save(self, button, fn, *args, saved=("Saved", "Saved."), not_saved_hint=""):
+        button.config(state="disabled")
+        self.parent_app.db_worker.submit(
+            fn, *args, on_done=lambda result: self.save_finished(saved, result),
+            on_error=lambda error: self.save_failed(button, error, not_saved_hint))
+
+    def save_finished(self, saved, result):
+        title, message = saved
+        messagebox.showinfo(title, message.format(result))
+        if self.winfo_exists():
+            self.destroy()
+
+    def save_failed(self, button, error, hint):
+        parent = self if self.winfo_exists() else self.parent_app
+        if parent is self:
+            button.config(state="normal")
+        if isinstance(error, ValueError):
+            messagebox.showerror("Invalid Value", str(error), parent=parent)
+        elif isinstance(error, (ConcurrentModification, KeyError)):
+            messagebox.showerror("Not Saved", f"{error}{hint}", parent=parent)
+        else:
+            messagebox.showerror("Database Error", str(error), parent=parent)
+
+
+class AddProductWindow(FormWindow):
     def __init__(self, parent_app):
         super().__init__(parent_app)
         self.title("Add New Product")
@@ -486,16 +3407,13 @@ class AddProductWindow(tk.Toplevel):
             entry.grid(row=i, column=1, padx=5, pady=5)
             self.entries[text] = entry
 
-        ttk.Button(self, text="Submit", command=self.submit).grid(row=len(labels), column=0, columnspan=2, pady=10)
+        self.submit_button = ttk.Button(self, text="Submit", command=self.submit)
+        self.submit_button.grid(row=len(labels), column=0, columnspan=2, pady=10)
 
     def submit(self):
-        meds = self.parent_app.medicine_db.fetch_all_medicines()
-        try:
-            new_sl = int(meds[-1][0]) + 1 if meds else 1
-        except Exception:
-            new_sl = 1
         data = (
-            new_sl,
+            None,  # sl_no is an INTEGER PRIMARY KEY; SQLite allocates the next one
+
             self.entries["Name"].get(),
             self.entries["Type"].get(),
             self.entries["Qty Left"].get(),
@@ -505,18 +3423,45 @@ class AddProductWindow(tk.Toplevel):
             self.entries["Rack"].get(),
             self.entries["MFG"].get(),
         )
-        self.parent_app.medicine_db.insert_medicine(data)
-        messagebox.showinfo("Success", "Product added successfully.")
-        self.destroy()
+        self.save(self.submit_button, self.parent_app.medicine_db.insert_medicine, data,
+                  saved=("Success", "Product added successfully."))
 
 
-class ModifyProductWindow(tk.Toplevel):
+class ReceiveLotWindow(FormWindow):
+    def __init__(self, parent_app, med_values):
+        super().__init__(parent_app)
+        self.title("Receive Lot")
+        self.resizable(False, False)
+        self.parent_app = parent_app
+        self.sl_no = med_values[0]
+
+        ttk.Label(self, text=f"New lot of {med_values[1]} (ID {self.sl_no})", font=("Segoe UI", 12, "bold")).grid(
+            row=0, column=0, columnspan=2, pady=10)
+        labels = ["Lot No", "Quantity", "Expiry Date (DD/MM/YY)"]
+        self.entries = {}
+        for i, text in enumerate(labels):
+            ttk.Label(self, text=f"{text}:").grid(row=i + 1, column=0, padx=5, pady=5, sticky="e")
+            entry = ttk.Entry(self, width=30)
+            entry.grid(row=i + 1, column=1, padx=5, pady=5)
+            self.entries[text] = entry
+
+        self.submit_button = ttk.Button(self, text="Receive", command=self.submit)
+        self.submit_button.grid(row=len(labels) + 1, column=0, columnspan=2, pady=10)
+
+    def submit(self):
+        self.save(self.submit_button, self.parent_app.medicine_db.receive_lot, self.sl_no,
+                  self.entries["Lot No"].get(), self.entries["Quantity"].get(),
+                  self.entries["Expiry Date (DD/MM/YY)"].get(), saved=("Received", "Lot received."))
+
+
+class ModifyProductWindow(FormWindow):
     def __init__(self, parent_app, med_values):
         super().__init__(parent_app)
         self.title("Modify Product")
         self.resizable(False, False)
         self.parent_app = parent_app
         self.med_values = med_values
+        self.version = None
 
         fields = ["Name", "Type", "Qty Left", "Cost", "Purpose", "Expiry Date", "Rack", "MFG"]
         self.entries = {}
@@ -525,12 +3470,31 @@ class ModifyProductWindow(tk.Toplevel):
         )
         for i, field in enumerate(fields):
             ttk.Label(self, text=f"{field}:").grid(row=i+1, column=0, padx=5, pady=5, sticky="e")
-            entry = ttk.Entry(self, width=30)
-            entry.insert(0, med_values[i+1])
+            entry = ttk.Entry(self, width=30, state="disabled")
             entry.grid(row=i+1, column=1, padx=5, pady=5)
             self.entries[field] = entry
 
-        ttk.Button(self, text="Save Changes", command=self.save_changes).grid(row=len(fields)+1, column=0, columnspan=2, pady=10)
+        self.save_button = ttk.Button(self, text="Save Changes", command=self.save_changes, state="disabled")
+        self.save_button.grid(row=len(fields)+1, column=0, columnspan=2, pady=10)
+        # The form is filled from the row read together with its version on the DB worker
+        # (not from the possibly stale Treeview values), so the version check covers every
+        # field the save writes back.
+        parent_app.db_worker.submit(parent_app.medicine_db.get_medicine_with_version, med_values[0],
+                                    on_done=self.load_row)
+
+    def load_row(self, loaded):
+        if not self.winfo_exists():
+            return
+        row, version = loaded
+        if row is None:
+            messagebox.showerror("Not Found", f"Product ID {self.med_values[0]} no longer exists.", parent=self)
+            self.destroy()
+            return
+        for entry, value in zip(self.entries.values(), row[1:]):
+            entry.config(state="normal")
+            entry.insert(0, value)
+        self.version = version
+        self.save_button.config(state="normal")
 
     def save_changes(self):
         sl_no = self.med_values[0]
@@ -544,16 +3508,103 @@ class ModifyProductWindow(tk.Toplevel):
             self.entries["Rack"].get(),
             self.entries["MFG"].get(),
         )
-        fields = ("name", "type", "qty_left", "cost", "purpose", "exp_date", "rack", "mfg")
-        for field, value in zip(fields, new_values):
-            self.parent_app.medicine_db.update_medicine(field, value, sl_no)
-        messagebox.showinfo("Updated", "Product updated successfully.")
+        changes = dict(zip(MED_COLUMNS[1:], new_values))
+        self.save(self.save_button, self.parent_app.medicine_db.update_medicines, [(sl_no, changes, self.version)],
+                  saved=("Updated", "Product updated successfully."),
+                  not_saved_hint="\nClose this window and modify the product again.")
+
+
+class RerenderBillsWindow(tk.Toplevel):
+    # Re-renders every bill in a date range from the sales ledger, e.g. for an audit.
+    def __init__(self, parent_app, fmt):
+        super().__init__(parent_app)
+        self.title("Re-render Bills")
+        self.resizable(False, False)
+        self.parent_app = parent_app
+
+        labels = ["From (DD/MM/YY)", "To (DD/MM/YY)"]
+        self.entries = {}
+        for i, text in enumerate(labels):
+            ttk.Label(self, text=f"{text}:").grid(row=i, column=0, padx=5, pady=5, sticky="e")
+            entry = ttk.Entry(self, width=20)
+            entry.grid(row=i, column=1, padx=5, pady=5)
+            self.entries[text] = entry
+        self.entries["To (DD/MM/YY)"].insert(0, date.today().strftime("%d/%m/%y"))
+        self.formats = {}
+        format_frame = ttk.Frame(self)
+        format_frame.grid(row=len(labels), column=0, columnspan=2, pady=5)
+        for i, name in enumerate(BILL_FORMATS):
+            self.formats[name] = tk.BooleanVar(value=name == fmt)
+            ttk.Checkbutton(format_frame, text=name, variable=self.formats[name]).grid(row=0, column=i, padx=5)
+        ttk.Button(self, text="Choose Folder && Render", command=self.submit).grid(
+            row=len(labels) + 1, column=0, columnspan=2, pady=10)
+
+    def submit(self):
+        start = parse_exp_date(self.entries["From (DD/MM/YY)"].get())
+        end = parse_exp_date(self.entries["To (DD/MM/YY)"].get())
+        formats = [name for name, var in self.formats.items() if var.get()]
+        if start is None or end is None or start > end:
+            messagebox.showwarning("Dates", "Enter a valid date range.", parent=self)
+            return
+        if not formats:
+            messagebox.showwarning("Format", "Select at least one format.", parent=self)
+            return
+        out_dir = filedialog.askdirectory(title="Write Bills To", parent=self)
+        if not out_dir:
+            return
+        app = self.parent_app
+        app.bill_spooler.submit(
+            rerender_bills, app.medicine_db, start, end, formats, out_dir,
+            on_done=lambda count: messagebox.showinfo("Re-render Bills", f"Wrote {count} bill(s) to {out_dir}."),
+            on_error=lambda e: messagebox.showerror("Re-render Failed", str(e)))
         self.destroy()
 
 
+class BulkEditWindow(FormWindow):
+    FIELDS = {"Cost": "cost", "Rack": "rack", "Type": "type", "Purpose": "purpose", "MFG": "mfg"}
+
+    def __init__(self, parent_app, sl_nos):
+        super().__init__(parent_app)
+        self.title("Bulk Edit")
+        self.resizable(False, False)
+        self.parent_app = parent_app
+        self.targets = None
+
+        ttk.Label(self, text=f"Editing {len(sl_nos)} product(s)", font=("Segoe UI", 12, "bold")).grid(
+            row=0, column=0, columnspan=2, pady=10)
+        ttk.Label(self, text="Field:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+        self.field_box = ttk.Combobox(self, values=list(self.FIELDS), state="readonly", width=27)
+        self.field_box.current(0)
+        self.field_box.grid(row=1, column=1, padx=5, pady=5)
+        ttk.Label(self, text="New Value:").grid(row=2, column=0, padx=5, pady=5, sticky="e")
+        self.entry_value = ttk.Entry(self, width=30)
+        self.entry_value.grid(row=2, column=1, padx=5, pady=5)
+        self.apply_button = ttk.Button(self, text="Apply", command=self.apply, state="disabled")
+        self.apply_button.grid(row=3, column=0, columnspan=2, pady=10)
+        # Versions are captured now (on the DB worker) so edits made elsewhere meanwhile
+        # are detected; Apply waits for them.
+        db = parent_app.medicine_db
+        parent_app.db_worker.submit(lambda: [(sl_no, db.get_version(sl_no)) for sl_no in sl_nos],
+                                    on_done=self.set_targets)
+
+    def set_targets(self, targets):
+        if self.winfo_exists():
+            self.targets = targets
+            self.apply_button.config(state="normal")
+
+    def apply(self):
+        column = self.FIELDS[self.field_box.get()]
+        value = self.entry_value.get()
+        updates = [(sl_no, {column: value}, version) for sl_no, version in self.targets]
+        self.save(self.apply_button, self.parent_app.medicine_db.update_medicines, updates,
+                  saved=("Updated", "Updated {} product(s)."), not_saved_hint="\nNo products were changed.")
+
+
 # ---------------------------
 # Run the Application
 # ---------------------------
 if __name__ == "__main__":
-    app = MedicalManagementApp()
+    if os.environ.get("MEDICAL_PROFILE") == "1":
+        PROFILER.install()
+    app = MedicalManagementApp(os.environ.get("MEDICAL_SERVICE_URL"))
     app.mainloop()
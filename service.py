@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import json
+import queue
+import random
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import parse_qs, urlsplit
+
+from main import ConcurrentModification, MedicineDB, StockShortage, backup_database
+
+# ---------------------------
+# Database Access
+# ---------------------------
+DEFAULT_PORT = 8750
+
+
+class ReaderPool:
+    # A fixed set of read connections (WAL readers never block the writer), each
+    # handed to one thread at a time.
+    def __init__(self, db_path, size):
+        self.handles = queue.Queue()
+        for _ in range(size):
+            self.handles.put(MedicineDB(db_path))
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db-reader")
+
+    def _call(self, fn, args):
+        db = self.handles.get()
+        try:
+            return fn(db, *args)
+        finally:
+            self.handles.put(db)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.handles.empty():
+            self.handles.get().conn.close()
+
+
+class Writer:
+    # The only connection that writes. Jobs run one at a time on a single thread;
+    # checkouts that queue up while a batch is committing go out together in the
+    # next batch (one transaction, one fsync).
+    MAX_BATCH = 64
+
+    def __init__(self, db_path):
+        self.db = MedicineDB(db_path)
+        self.db.load_catalog()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.checkouts = asyncio.Queue()
+        self.batches = 0
+        self.batched_bills = 0
+        self.task = asyncio.get_running_loop().create_task(self._checkout_loop())
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def checkout(self, bill_items, customer, address):
+        future = asyncio.get_running_loop().create_future()
+        await self.checkouts.put(((bill_items, customer, address), future))
+        return await future
+
+    async def _checkout_loop(self):
+        while True:
+            batch = [await self.checkouts.get()]
+            while len(batch) < self.MAX_BATCH and not self.checkouts.empty():
+                batch.append(self.checkouts.get_nowait())
+            try:
+                results = await self.run(self.db.checkout_many, [bill for bill, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            self.batches += 1
+            self.batched_bills += len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        self.task.cancel()
+        self.executor.shutdown()
+        self.db.conn.close()
+
+
+# ---------------------------
+# HTTP/JSON Service
+# ---------------------------
+class HTTPError(Exception):
+    def __init__(self, status, payload):
+        self.status = status
+        self.payload = payload
+        super().__init__(payload)
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 500: "Internal Server Error"}
+
+
+def query_int(query, name, default=None):
+    try:
+        return int(query[name][0])
+    except KeyError:
+        if default is None:
+            raise HTTPError(400, {"error": "bad_request", "message": f"missing parameter {name!r}"})
+        return default
+    except ValueError:
+        raise HTTPError(400, {"error": "bad_request", "message": f"parameter {name!r} must be an integer"})
+
+
+def query_dates(query):
+    try:
+        return date.fromisoformat(query["start"][0]), date.fromisoformat(query["end"][0])
+    except (KeyError, ValueError):
+        raise HTTPError(400, {"error": "bad_request", "message": "start and end must be YYYY-MM-DD dates"})
+
+
+class MedicineService:
+    # Routes are (method, path) -> coroutine(query, body) returning a JSON-able value.
+    RECENT_CHECKOUTS = 1024  # idempotency keys remembered for resent checkouts
+
+    def __init__(self, db_path, readers=4):
+        self.db_path = db_path
+        self.writer = Writer(db_path)
+        self.readers = ReaderPool(db_path, readers)
+        self.routes = {
+            ("GET", "/catalog"): self.get_catalog,
+            ("GET", "/catalog/changes"): self.get_catalog_changes,
+            ("GET", "/search"): self.get_search,
+            ("GET", "/expiry"): self.get_expiry,
+            ("GET", "/stats"): self.get_stats,
+            ("GET", "/sales"): self.get_sale,
+            ("GET", "/sales/range"): self.get_sales_range,
+            ("GET", "/reorder"): self.get_reorder,
+            ("GET", "/lots"): self.get_lots,
+            ("POST", "/checkout"): self.post_checkout,
+            ("POST", "/medicines"): self.post_medicine,
+            ("POST", "/medicines/update"): self.post_medicine_updates,
+            ("POST", "/medicines/delete"): self.post_medicine_delete,
+            ("POST", "/medicines/import"): self.post_import,
+            ("POST", "/medicines/import/finish"): self.post_import_finish,
+            ("POST", "/lots"): self.post_lot,
+            ("POST", "/backup"): self.post_backup,
+        }
+        # Starts somewhere random so a client that outlived a restart cannot mistake the
+        # new catalog's journal for the one it was following (clients send 0 at first).
+        self.generation = random.randrange(1, 2 ** 31)
+        self._catalog = None
+        self.recent_checkouts = {}  # idempotency key -> future of the first attempt
+
+    def close(self):
+        self.writer.close()
+        self.readers.close()
+
+    # The writer's in-memory catalog is authoritative. A bulk import replaces it with a
+    # fresh object whose version restarts at zero, so clients also track a generation.
+    def _catalog_state(self):
+        db = self.writer.db
+        with db.lock:
+            catalog = db.catalog
+            if catalog is not self._catalog:
+                self._catalog = catalog
+                self.generation += 1
+            return catalog, self.generation
+
+    def _catalog_page(self, offset, limit):
+        catalog, generation = self._catalog_state()
+        with self.writer.db.lock:
+            rows = [row + (catalog.row_version(row[0]),) for row in catalog.window(offset, limit)]
+            return {"generation": generation, "version": catalog.version, "total": len(catalog), "rows": rows}
+
+    def _catalog_changes(self, generation, since):
+        catalog, current = self._catalog_state()
+        with self.writer.db.lock:
+            changed = catalog.changes_since(since) if generation == current else None
+            result = {"generation": current, "version": catalog.version, "reset": changed is None,
+                      "rows": [], "removed": []}
+            for key in (catalog.rows if changed is None else changed):
+                row = catalog.get(key)
+                if row is None:
+                    result["removed"].append(key)
+                else:
+                    result["rows"].append(row + (catalog.row_version(key),))
+            return result
+
+    async def get_catalog(self, query, body):
+        offset = query_int(query, "offset", 0)
+        limit = query_int(query, "limit", 100)
+        return await asyncio.to_thread(self._catalog_page, offset, limit)
+
+    async def get_catalog_changes(self, query, body):
+        generation = query_int(query, "generation", 0)
+        since = query_int(query, "since", 0)
+        return await asyncio.to_thread(self._catalog_changes, generation, since)
+
+    async def get_search(self, query, body):
+        text = query.get("q", [""])[0]
+        return await self.readers.run(MedicineDB.search, text, query_int(query, "limit", 50))
+
+    async def get_expiry(self, query, body):
+        return await self.readers.run(MedicineDB.expiring_between, *query_dates(query))
+
+    async def get_stats(self, query, body):
+        # Inventory counters live in the writer's catalog.
+        return await asyncio.to_thread(self.writer.db.dashboard_stats, query_int(query, "top", 5))
+
+    async def get_sale(self, query, body):
+        return await self.readers.run(MedicineDB.get_sale, query_int(query, "bill_no"))
+
+    async def get_sales_range(self, query, body):
+        return await self.readers.run(MedicineDB.bills_between, *query_dates(query))
+
+    async def get_reorder(self, query, body):
+        return await self.readers.run(MedicineDB.reorder_suggestions, query_int(query, "limit", -1))
+
+    async def get_lots(self, query, body):
+        return await self.readers.run(MedicineDB.lots_for_name, query.get("name", [""])[0])
+
+    async def post_checkout(self, query, body):
+        items = body.get("items")
+        customer = body.get("customer", "")
+        address = body.get("address", "")
+        key = body.get("idempotency_key")
+        if (not isinstance(items, list) or not all(isinstance(item, list) and len(item) == 4 for item in items)
+                or not isinstance(customer, str) or not isinstance(address, str)):
+            raise HTTPError(400, {"error": "bad_request",
+                                  "message": "items must be a list of [sl_no, name, qty, price]"})
+        if key is not None and not isinstance(key, str):
+            raise HTTPError(400, {"error": "bad_request", "message": "idempotency_key must be a string"})
+        if key is None:
+            return {"bill_no": await self.writer.checkout(items, customer, address)}
+        # A resent request waits on (or re-reads) the first attempt's outcome.
+        attempt = self.recent_checkouts.get(key)
+        if attempt is None:
+            attempt = self.recent_checkouts[key] = asyncio.ensure_future(
+                self.writer.checkout(items, customer, address))
+            if len(self.recent_checkouts) > self.RECENT_CHECKOUTS:
+                del self.recent_checkouts[next(iter(self.recent_checkouts))]
+        return {"bill_no": await asyncio.shield(attempt)}
+
+    async def post_medicine(self, query, body):
+        await self.writer.run(self.writer.db.insert_medicine, tuple(body["row"]))
+        return {}
+
+    async def post_medicine_updates(self, query, body):
+        return {"updated": await self.writer.run(self.writer.db.update_medicines, body["updates"])}
+
+    async def post_medicine_delete(self, query, body):
+        await self.writer.run(self.writer.db.delete_medicine, body["sl_no"])
+        return {}
+
+    async def post_lot(self, query, body):
+        lot_id = await self.writer.run(self.writer.db.receive_lot, body["sl_no"], body.get("lot_no", ""),
+                                       body["qty"], body["exp_date"])
+        return {"lot_id": lot_id}
+
+    async def post_backup(self, query, body):
+        # An online snapshot through its own connection; neither the writer nor the
+        # readers wait for it.
+        return {"path": await asyncio.to_thread(backup_database, self.db_path)}
+
+    async def post_import(self, query, body):
+        # A bulk file arrives as many requests; its search index stays suspended until
+        # the client posts /medicines/import/finish (or the service restarts).
+        db, bulk = self.writer.db, body.get("bulk", False)
+        imported, errors = await self.writer.run(
+            lambda: db.import_records(body["records"], bulk, rebuild_index=not bulk))
+        return {"imported": imported, "errors": errors}
+
+    async def post_import_finish(self, query, body):
+        await self.writer.run(self.writer.db.finish_bulk_import)
+        return {}
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        route = self.routes.get((method, url.path))
+        if route is None:
+            known = any(path == url.path for _, path in self.routes)
+            return (405, {"error": "method_not_allowed"}) if known else (404, {"error": "not_found"})
+        try:
+            payload = json.loads(body) if body else {}
+            return 200, await route(parse_qs(url.query), payload)
+        except HTTPError as e:
+            return e.status, e.payload
+        except StockShortage as e:
+            return 409, {"error": "stock_shortage", "shortages": e.shortages}
+        except ConcurrentModification as e:
+            return 409, {"error": "conflict", "sl_nos": e.sl_nos}
+        except KeyError as e:
+            return 404, {"error": "not_found", "message": str(e.args[0]) if e.args else ""}
+        except (ValueError, TypeError) as e:
+            return 400, {"error": "bad_request", "message": str(e)}
+        except Exception as e:
+            return 500, {"error": "internal", "message": str(e)}
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; requests on one connection are answered in order.
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.dispatch(method, target, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n"
+                             .encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def backup_every(db_path, hours):
+    while True:
+        await asyncio.sleep(hours * 3600)
+        try:
+            print(f"Backed up to {await asyncio.to_thread(backup_database, db_path)}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Backup failed: {e}")
+
+
+async def serve(db_path, host="127.0.0.1", port=DEFAULT_PORT, readers=4, started=None, backup_hours=None):
+    # started: optional callback(port, service), e.g. for a load test binding port 0.
+    service = MedicineService(db_path, readers)
+    server = await asyncio.start_server(service.handle, host, port)
+    if started is not None:
+        started(server.sockets[0].getsockname()[1], service)
+    backups = asyncio.get_running_loop().create_task(backup_every(db_path, backup_hours)) if backup_hours else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if backups is not None:
+            backups.cancel()
+        service.close()
+
+
+# ---------------------------
+# Entry Point
+# ---------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP/JSON service over medicine.db for store terminals.")
+    parser.add_argument("--db", default="medicine.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--readers", type=int, default=4, help="size of the read connection pool")
+    parser.add_argument("--backup-hours", type=float, help="take an online snapshot of --db this often")
+    parser.add_argument("--restore", metavar="SNAPSHOT", help="restore --db from a snapshot and exit (service stopped)")
+    args = parser.parse_args()
+    if args.restore:
+        try:
+            MedicineDB(args.db).restore(args.restore)
+        except (sqlite3.Error, ValueError) as e:
+            parser.exit(1, f"Restore failed: {e}\n")
+        print(f"Restored {args.db} from {args.restore}")
+        return
+    print(f"Serving {args.db} on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.readers, backup_hours=args.backup_hours))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+
+import benchmark
+
+
+def make_databases(tmp_path):
+    db_path = os.path.join(tmp_path, "medicine.db")
+    admin_path = os.path.join(tmp_path, "admin.db")
+    benchmark.create_medicine_db(db_path, 2000)
+    benchmark.create_admin_db(admin_path, 5)
+    return db_path, admin_path
+
+
+def test_executed_statements_do_not_scan_big_tables(tmp_path):
+    plans = benchmark.query_plans(*make_databases(tmp_path))
+    executed = [sql for _, sql, _, _ in plans]
+    # The statements come from running the code, so new query paths are covered as they appear.
+    assert any("med_fts MATCH" in sql for sql in executed)
+    assert any(sql.startswith("UPDATE med SET qty_left = qty_left - ?, version = version + 1") for sql in executed)
+    assert any("FROM log" in sql for sql in executed)
+    scans = [f"[{name}] {sql}: {'; '.join(plan)}" for name, sql, plan, scanned in plans if scanned]
+    assert not scans, "\n".join(scans)
+
+
+def test_full_scans_resolves_aliases():
+    sql = "SELECT l.qty FROM lots l JOIN med m ON m.sl_no = l.sl_no WHERE l.qty > 0"
+    assert benchmark.full_scans(sql, ["SCAN l", "SEARCH m USING INTEGER PRIMARY KEY (rowid=?)"]) == ["lots"]
+    assert benchmark.full_scans(sql, ["SEARCH l USING INDEX idx_lots_fefo (sl_no=?)"]) == []
+    assert benchmark.full_scans("SELECT rowid FROM med_fts WHERE med_fts MATCH ?",
+                                ["SCAN med_fts VIRTUAL TABLE INDEX 0:M3"]) == []
+    assert benchmark.full_scans("SELECT * FROM item_velocity v", ["SCAN v"]) == []